@@ -0,0 +1,75 @@
+import base64
+import binascii
+import hashlib
+import mimetypes
+
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from rest_framework import serializers
+
+# Кратно четырём, чтобы каждый кусок декодировался отдельно
+DECODE_CHUNK_SIZE = 64 * 1024
+
+
+class StreamingBase64ImageField(serializers.ImageField):
+    """Картинка в формате data:image/...;base64,...
+
+    Строка декодируется кусками сразу во временный файл на диске,
+    имя файла - SHA-256 его содержимого.
+    """
+
+    default_error_messages = {
+        "invalid_base64": "Картинка должна быть строкой data:image/...;base64",
+    }
+
+    def to_internal_value(self, data):
+        if not isinstance(data, str) or ";base64," not in data[:100]:
+            self.fail("invalid_base64")
+        header, payload = data.split(";base64,", 1)
+        content_type = header.replace("data:", "", 1)
+        extension = mimetypes.guess_extension(content_type) or ".jpg"
+
+        upload = TemporaryUploadedFile("image", content_type, 0, None)
+        digest = hashlib.sha256()
+        try:
+            for start in range(0, len(payload), DECODE_CHUNK_SIZE):
+                chunk = base64.b64decode(
+                    payload[start:start + DECODE_CHUNK_SIZE], validate=True)
+                digest.update(chunk)
+                upload.write(chunk)
+        except (binascii.Error, ValueError):
+            upload.close()
+            self.fail("invalid_base64")
+        upload.size = upload.tell()
+        upload.seek(0)
+        upload.name = digest.hexdigest() + extension
+        try:
+            return super().to_internal_value(upload)
+        except serializers.ValidationError:
+            upload.close()
+            raise
+
+    def to_representation(self, value):
+        if not value:
+            return None
+        return value.url
+
+
+class BulkPrimaryKeyRelatedField(serializers.ListField):
+    """Список id, который разрешается в объекты одним запросом IN"""
+
+    default_error_messages = {
+        "does_not_exist": "Объекты с id {pk_values} не найдены",
+    }
+
+    def __init__(self, queryset, **kwargs):
+        self.queryset = queryset
+        kwargs.setdefault("child", serializers.IntegerField())
+        super().__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        pk_values = super().to_internal_value(data)
+        found = self.queryset.in_bulk(set(pk_values))
+        missing = sorted(set(pk_values) - found.keys())
+        if missing:
+            self.fail("does_not_exist", pk_values=missing)
+        return [found[pk] for pk in pk_values]
@@ -1,38 +1,112 @@
-from django_filters import CharFilter, FilterSet, NumberFilter
-from rest_framework.filters import SearchFilter
+from django import forms
+from django.db.models import Count, Exists, F, OuterRef
+from django_filters import (CharFilter, ChoiceFilter, Filter, FilterSet,
+                            NumberFilter)
+from rest_framework.filters import BaseFilterBackend
 
-from recipes.models import Recipe
+from recipes.models import Recipe, RecipeTag
+from recipes.search import search_ingredients
 
+RECIPE_ORDERINGS = {
+    # счётчик на строке рецепта, индекс recipe_popular_idx
+    "popular": ("-favorites_count", "-id"),
+    # LEFT JOIN с рейтингом, индекс recipe_trending_idx
+    "trending": (F("ranking__trending").desc(nulls_last=True), "-id"),
+}
+
+
+class IngredientNameSearchFilter(BaseFilterBackend):
+    """Автодополнение по ?name=: сначала совпадения с начала названия"""
 
-class IngredientNameSearchFilter(SearchFilter):
     search_param = "name"
 
+    def filter_queryset(self, request, queryset, view):
+        query = request.query_params.get(self.search_param, "").strip()
+        if not query or view.action != "list":
+            return queryset
+        return search_ingredients(query)
+
+
+class MultipleValueField(forms.Field):
+    widget = forms.MultipleHiddenInput
+
+    def to_python(self, value):
+        return [item for item in value or () if item]
+
+
+class MultipleValueFilter(Filter):
+    """Все значения повторяющегося параметра: ?tags=a&tags=b"""
+
+    field_class = MultipleValueField
+
 
 class RecipeFilter(FilterSet):
 
     author = CharFilter(field_name="author__id", lookup_expr="iexact")
-    tags = CharFilter(field_name="tags__slug", lookup_expr="iexact")
+    tags = MultipleValueFilter(method="get_tags")
+    tags_match = ChoiceFilter(
+        choices=(("any", "any"), ("all", "all")), method="skip")
     is_favorited = NumberFilter(
         field_name="is_favorited", method="get_is_favorited")
     is_in_shopping_cart = NumberFilter(
         field_name="is_in_shopping_cart", method="get_is_in_shopping_cart"
     )
+    search = CharFilter(method="get_search")
+    ordering = ChoiceFilter(
+        choices=[(name, name) for name in RECIPE_ORDERINGS],
+        method="get_ordering",
+    )
+
+    def get_tags(self, queryset, name, value):
+        """Полусоединение с RecipeTag вместо JOIN по тегам.
+
+        any - рецепт с любым из тегов (EXISTS), all - со всеми
+        (IN по рецептам, у которых нашлось столько же тегов).
+        """
+        slugs = set(value)
+        if not slugs:
+            return queryset
+        recipe_tags = RecipeTag.objects.filter(tag__slug__in=slugs)
+        if self.form.cleaned_data.get("tags_match") == "all":
+            return queryset.filter(
+                id__in=recipe_tags.values("recipe")
+                .annotate(matched=Count("id"))
+                .filter(matched=len(slugs))
+                .values("recipe")
+            )
+        return queryset.filter(
+            Exists(recipe_tags.filter(recipe=OuterRef("pk"))))
+
+    def skip(self, queryset, name, value):
+        return queryset
 
     def get_is_favorited(self, queryset, name, value):
         if value == 1 and not self.request.user.is_anonymous:
-            return queryset.filter(favorites_recipe__user=self.request.user)
+            return queryset.filter(is_favorited=True)
         return queryset
 
     def get_is_in_shopping_cart(self, queryset, name, value):
         if value == 1 and not self.request.user.is_anonymous:
-            return queryset.filter(carts_recipe__user=self.request.user)
+            return queryset.filter(is_in_shopping_cart=True)
         return queryset
 
+    def get_search(self, queryset, name, value):
+        value = value.strip()
+        if not value:
+            return queryset
+        return queryset.search(value)
+
+    def get_ordering(self, queryset, name, value):
+        return queryset.order_by(*RECIPE_ORDERINGS[value])
+
     class Meta:
         model = Recipe
         fields = (
             "author",
             "tags",
+            "tags_match",
             "is_favorited",
             "is_in_shopping_cart",
+            "search",
+            "ordering",
         )
@@ -0,0 +1,176 @@
+import hashlib
+import json
+
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+
+from recipes.models import (FavoriteRecipes, Ingredient, Recipe,
+                            ShoppingCart, Tag)
+from recipes.utils import (actual_count, change_counter, get_cache_version,
+                           get_flags_version, invalidate_recipe_flags,
+                           invalidate_shopping_cart)
+
+
+class ReferenceCacheMixin:
+    """Кеш ответов справочников (теги, ингредиенты).
+
+    В кеше лежат готовые данные ответа и ETag. Ключ содержит версию
+    модели, которую сигналы увеличивают при любом изменении, поэтому
+    старые записи просто перестают читаться.
+    """
+
+    cache_timeout = 60 * 60 * 24
+
+    def perform_authentication(self, request):
+        # Справочники открыты всем: токен проверяется только если
+        # к request.user обратятся, ответ из кеша обходится без базы.
+        pass
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(request, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(
+            request, super().retrieve, *args, **kwargs)
+
+    def cached_response(self, request, view, *args, **kwargs):
+        label = self.queryset.model._meta.label
+        version = get_cache_version(label)
+        key = f"api:{label}:{version}:{request.get_full_path()}"
+        entry = cache.get(key)
+        if entry is None:
+            response = view(request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            payload = json.dumps(
+                response.data, cls=DjangoJSONEncoder, sort_keys=True)
+            digest = hashlib.md5(payload.encode()).hexdigest()
+            entry = (f'"{version}-{digest}"', response.data)
+            cache.set(key, entry, self.cache_timeout)
+        etag, data = entry
+        if etag in parse_etags(request.headers.get("If-None-Match", "")):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = Response(data)
+        response["ETag"] = etag
+        return response
+
+
+class RecipeConditionalGetMixin:
+    """ETag и Last-Modified для рецептов без сериализации ответа.
+
+    Общая для всех часть ответа описывается id и updated_at рецептов
+    страницы (updated_at сдвигается и при правке профиля автора),
+    count и ссылками пагинатора и версиями тегов и ингредиентов.
+    Флаги is_favorited, is_in_shopping_cart и is_subscribed
+    учитываются через версию флагов текущего пользователя,
+    которую сигналы сдвигают при любом изменении избранного,
+    списка покупок и подписок. Last-Modified флагов не видит,
+    поэтому отдаётся только анонимным пользователям.
+    """
+
+    shared_versions = (Tag, Ingredient)
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        if page is None:
+            return super().list(request, *args, **kwargs)
+        # Строки страницы всё равно нужны для ответа; count и ссылки
+        # пагинатор уже посчитал, вся выборка заново не агрегируется
+        state = [
+            self.paginator.get_paginated_response([]).data,
+            [(recipe.pk, recipe.updated_at) for recipe in page],
+        ]
+        return self.conditional_response(
+            request, state, None, self.page_response, page)
+
+    def page_response(self, request, page):
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    def retrieve(self, request, *args, **kwargs):
+        lookup = self.lookup_url_kwarg or self.lookup_field
+        updated_at = (
+            self.filter_queryset(self.get_queryset())
+            .prefetch_related(None)
+            .filter(**{self.lookup_field: kwargs[lookup]})
+            .values_list("updated_at", flat=True)
+            .first()
+        )
+        if updated_at is None:
+            return super().retrieve(request, *args, **kwargs)
+        return self.conditional_response(
+            request, [updated_at], updated_at,
+            super().retrieve, *args, **kwargs)
+
+    def conditional_response(self, request, state, last_modified, view,
+                             *args, **kwargs):
+        user = request.user
+        state = [
+            request.get_full_path(),
+            *(get_cache_version(model._meta.label)
+              for model in self.shared_versions),
+            "anonymous" if user.is_anonymous else get_flags_version(user),
+            *state,
+        ]
+        digest = hashlib.md5(
+            json.dumps(state, cls=DjangoJSONEncoder).encode()).hexdigest()
+        etag = f'W/"{digest}"'
+        if last_modified is not None and user.is_anonymous:
+            last_modified = int(last_modified.timestamp())
+        else:
+            last_modified = None
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = view(request, *args, **kwargs)
+        if response.status_code in (
+            status.HTTP_200_OK, status.HTTP_304_NOT_MODIFIED
+        ):
+            response["ETag"] = etag
+            if last_modified is not None:
+                response["Last-Modified"] = http_date(last_modified)
+        patch_vary_headers(response, ("Authorization",))
+        return response
+
+
+class UserRecipesMixin:
+    """Список рецептов пользователя: избранное или список покупок.
+
+    Строки вставляются и удаляются без сигналов, поэтому счётчик
+    рецептов и кеши пользователя обновляются через этот класс.
+    """
+
+    model = None
+    counter = None
+
+    def invalidate(self, user):
+        invalidate_recipe_flags(user.id)
+
+    def change_counters(self, recipe_ids, delta, changed):
+        recipes = Recipe.objects.filter(pk__in=recipe_ids)
+        if changed == len(recipe_ids):
+            change_counter(recipes, self.counter, delta)
+            return
+        # Часть строк успел изменить параллельный запрос: не угадываем,
+        # какие именно, а пересчитываем счётчики этих рецептов
+        recipes.update(**{self.counter: actual_count(self.model, "recipe")})
+
+
+class FavoritesMixin(UserRecipesMixin):
+    model = FavoriteRecipes
+    counter = "favorites_count"
+
+
+class ShoppingCartMixin(UserRecipesMixin):
+    model = ShoppingCart
+    counter = "in_carts_count"
+
+    def invalidate(self, user):
+        super().invalidate(user)
+        invalidate_shopping_cart(user.id)
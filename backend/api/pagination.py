@@ -0,0 +1,95 @@
+import hashlib
+import json
+from collections import OrderedDict
+
+from django.core.cache import cache
+from django.db import connection
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+from rest_framework.response import Response
+
+
+class FoodgramPagination(PageNumberPagination):
+    page_size_query_param = "limit"
+    max_page_size = 200
+
+
+class FeedCursorPagination(CursorPagination):
+    """Keyset-пагинация в порядке выдачи с необязательным общим количеством.
+
+    ?count=cached отдаёт точное количество из кеша, ?count=estimated -
+    оценку планировщика PostgreSQL.
+    """
+
+    ordering = "-id"
+    page_size_query_param = "limit"
+    max_page_size = 200
+    count_query_param = "count"
+    count_cache_timeout = 60
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count = self.get_count(
+            queryset, request.query_params.get(self.count_query_param))
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_ordering(self, request, queryset, view):
+        """Порядок, который уже задали фильтры (popular, поиск).
+
+        Позиция курсора берётся из первого поля, одинаковые позиции
+        DRF пропускает смещением. Порядок по выражению (trending)
+        в курсор не записать, такой запрос отклоняется.
+        """
+        ordering = tuple(
+            queryset.query.order_by
+            or queryset.model._meta.ordering
+            or (self.ordering,)
+        )
+        if not all(isinstance(field, str) for field in ordering):
+            raise ValidationError(
+                {"pagination": "Этот порядок выдачи не поддерживает курсор"})
+        return ordering
+
+    def get_count(self, queryset, mode):
+        if mode == "estimated" and connection.vendor == "postgresql":
+            plan = json.loads(queryset.order_by().explain(format="json"))
+            return plan[0]["Plan"]["Plan Rows"]
+        if mode in ("cached", "estimated"):
+            queryset = queryset.order_by()
+            key = "count:" + hashlib.md5(
+                str(queryset.query).encode()).hexdigest()
+            return cache.get_or_set(
+                key, queryset.count, self.count_cache_timeout)
+        return None
+
+    def get_paginated_response(self, data):
+        body = OrderedDict()
+        if self.count is not None:
+            body["count"] = self.count
+        body["next"] = self.get_next_link()
+        body["previous"] = self.get_previous_link()
+        body["results"] = data
+        return Response(body)
+
+
+class FeedPagination(FoodgramPagination):
+    """Постраничная выдача, а с ?pagination=cursor или ?cursor= - keyset"""
+
+    cursor_pagination_class = FeedCursorPagination
+    mode_query_param = "pagination"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor_paginator = None
+        if (
+            request.query_params.get(self.mode_query_param) == "cursor"
+            or self.cursor_pagination_class.cursor_query_param
+            in request.query_params
+        ):
+            self.cursor_paginator = self.cursor_pagination_class()
+            return self.cursor_paginator.paginate_queryset(
+                queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
@@ -0,0 +1,219 @@
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+
+from recipes.utils import percentile
+
+logger = logging.getLogger(__name__)
+
+current_profile = ContextVar("current_profile", default=None)
+
+# Верхние границы корзин гистограммы общего времени, мс
+HISTOGRAM_BOUNDS = (10, 25, 50, 100, 250, 500, 1000, 2500)
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class Profile:
+    """Запросы к базе, время обработчика и общее время одного запроса"""
+
+    def __init__(self):
+        self.endpoint = None
+        self.queries = 0
+        self.db_time = 0.0
+        self.view_time = 0.0
+        self.view_started = None
+        self.started = time.perf_counter()
+
+    def execute(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.db_time += time.perf_counter() - started
+
+    @contextmanager
+    def track_queries(self):
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(self.execute))
+            yield
+
+    def sample(self):
+        return {
+            "queries": self.queries,
+            "db_ms": self.db_time * 1000,
+            "view_ms": self.view_time * 1000,
+            "total_ms": (time.perf_counter() - self.started) * 1000,
+        }
+
+
+class ProfiledViewMixin:
+    """Время обработчика DRF без запросов к базе.
+
+    Отсчёт идёт после аутентификации и проверки прав и до
+    finalize_response, так что это в основном сериализация ответа.
+    У представлений djoser без этого класса view_ms равно нулю.
+    """
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        profile = current_profile.get()
+        if profile is not None:
+            profile.view_started = (time.perf_counter(), profile.db_time)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        profile = current_profile.get()
+        if profile is not None and profile.view_started is not None:
+            started, db_time = profile.view_started
+            profile.view_time += (
+                time.perf_counter() - started - (profile.db_time - db_time))
+            profile.view_started = None
+        return super().finalize_response(request, response, *args, **kwargs)
+
+
+def endpoint_name(request, view_func):
+    """RecipeViewSet.list, CurrentUserSubscriptionsView.get и т. п."""
+    view_class = getattr(view_func, "cls", None) or getattr(
+        view_func, "view_class", None)
+    if view_class is None:
+        return f"{view_func.__module__}.{view_func.__name__}"
+    method = request.method.lower()
+    actions = getattr(view_func, "actions", None) or {}
+    return f"{view_class.__name__}.{actions.get(method, method)}"
+
+
+class ProfileRegistry:
+    """Последние замеры по каждому эндпоинту в памяти процесса"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {}
+
+    def record(self, endpoint, sample):
+        with self.lock:
+            if endpoint not in self.samples:
+                self.samples[endpoint] = deque(
+                    maxlen=settings.API_PROFILING_WINDOW)
+            self.samples[endpoint].append(sample)
+
+    def clear(self):
+        with self.lock:
+            self.samples.clear()
+
+    def snapshot(self):
+        with self.lock:
+            samples = {
+                endpoint: list(window)
+                for endpoint, window in self.samples.items()
+            }
+        return {
+            endpoint: self.summary(endpoint, window)
+            for endpoint, window in sorted(samples.items())
+        }
+
+    def summary(self, endpoint, window):
+        summary = {"count": len(window), "budget": get_budget(endpoint)}
+        for metric in ("queries", "db_ms", "view_ms", "total_ms"):
+            values = [sample[metric] for sample in window]
+            summary[metric] = {
+                "p50": round(percentile(values, 50), 3),
+                "p95": round(percentile(values, 95), 3),
+                "max": round(max(values, default=0), 3),
+            }
+        histogram = dict.fromkeys(
+            [f"<={bound}" for bound in HISTOGRAM_BOUNDS] + ["inf"], 0)
+        for sample in window:
+            bucket = next(
+                (f"<={bound}" for bound in HISTOGRAM_BOUNDS
+                 if sample["total_ms"] <= bound),
+                "inf",
+            )
+            histogram[bucket] += 1
+        summary["total_ms"]["histogram"] = histogram
+        return summary
+
+
+registry = ProfileRegistry()
+
+
+def get_budget(endpoint):
+    budgets = settings.API_QUERY_BUDGETS
+    return budgets.get(endpoint, budgets.get(endpoint.split(".")[0]))
+
+
+def check_budget(endpoint, queries):
+    budget = get_budget(endpoint)
+    if budget is None or queries <= budget:
+        return
+    message = f"{endpoint}: {queries} SQL-запросов при бюджете {budget}"
+    if settings.API_QUERY_BUDGET_ACTION == "raise":
+        raise QueryBudgetExceeded(message)
+    logger.warning(message)
+
+
+def server_timing(sample):
+    return ", ".join((
+        f'db;dur={sample["db_ms"]:.1f};desc="{sample["queries"]} queries"',
+        f'view;dur={sample["view_ms"]:.1f}',
+        f'total;dur={sample["total_ms"]:.1f}',
+    ))
+
+
+class ProfilingMiddleware:
+    """Профилирование запросов API, включается настройкой API_PROFILING.
+
+    Замеры уходят в заголовок Server-Timing и в гистограмму,
+    которую показывает /api/profiling/ (только для staff).
+    Потоковые ответы дозамеряются, когда тело дочитано.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        profile = Profile()
+        token = current_profile.set(profile)
+        try:
+            with profile.track_queries():
+                response = self.get_response(request)
+        finally:
+            current_profile.reset(token)
+        if profile.endpoint is None:
+            return response
+        response["Server-Timing"] = server_timing(profile.sample())
+        if response.streaming:
+            response.streaming_content = self.finish_stream(
+                profile, response.streaming_content)
+        else:
+            self.finish(profile)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        profile = current_profile.get()
+        if profile is not None:
+            profile.endpoint = endpoint_name(request, view_func)
+
+    def finish(self, profile):
+        registry.record(profile.endpoint, profile.sample())
+        check_budget(profile.endpoint, profile.queries)
+
+    def finish_stream(self, profile, content):
+        try:
+            with profile.track_queries():
+                yield from content
+        finally:
+            try:
+                self.finish(profile)
+            except QueryBudgetExceeded as error:
+                # Ответ уже отдаётся клиенту, прервать его нельзя
+                logger.warning(error)
@@ -1,15 +1,41 @@
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import prefetch_related_objects
 from djoser.serializers import UserCreateSerializer
-from drf_extra_fields.fields import Base64ImageField
 from rest_framework import exceptions, serializers
 
+from recipes.images import rendition_urls
 from recipes.models import (FavoriteRecipes, Ingredient, Recipe,
-                            RecipeIngredient, RecipeTag, ShoppingCart, Tag)
+                            RecipeIngredient, RecipeTag, ShoppingCart, Tag,
+                            recipe_prefetches)
+from recipes.utils import (delete_rows, get_cache_version,
+                           invalidate_carts_with_recipe)
 from users.models import Follow
+from .fields import BulkPrimaryKeyRelatedField, StreamingBase64ImageField
 
 User = get_user_model()
 
 
+def get_subscribed_ids(context):
+    """Id авторов, на которых подписан текущий пользователь.
+
+    Загружаются одним запросом и хранятся в контексте сериализатора,
+    который общий для всех вложенных сериализаторов.
+    """
+    if "subscribed_ids" not in context:
+        request = context.get("request")
+        if request is None or request.user.is_anonymous:
+            context["subscribed_ids"] = set()
+        else:
+            context["subscribed_ids"] = set(
+                Follow.objects.filter(user=request.user).values_list(
+                    "author_id", flat=True)
+            )
+    return context["subscribed_ids"]
+
+
 class UserSerializer(UserCreateSerializer):
     is_subscribed = serializers.SerializerMethodField()
 
@@ -26,38 +52,14 @@ class UserSerializer(UserCreateSerializer):
         )
 
     def get_is_subscribed(self, obj):
-        request = self.context.get("request")
-        if request is None or request.user.is_anonymous:
-            return False
-        user = request.user
-        return Follow.objects.filter(author=obj, user=user).exists()
-
-
-class ManageSubscribeSerializer(UserSerializer):
-    recipes = serializers.SerializerMethodField("get_recipes")
-    recipes_count = serializers.ReadOnlyField(source="recipe_author.count")
-
-    class Meta:
-        model = User
-        fields = (
-            "id",
-            "email",
-            "username",
-            "first_name",
-            "last_name",
-            "is_subscribed",
-            "recipes",
-            "recipes_count",
-        )
-
-    def get_recipes(self, obj):
-        record = Recipe.objects.filter(author=obj)
-        return MiniRecipe(record, many=True).data
+        if hasattr(obj, "is_subscribed"):
+            return obj.is_subscribed
+        return obj.id in get_subscribed_ids(self.context)
 
 
 class CurrentUserSubscriptionsSeriazlizer(UserSerializer):
     recipes = serializers.SerializerMethodField(read_only=True)
-    recipes_count = serializers.ReadOnlyField(source="recipe_author.count")
+    recipes_count = serializers.IntegerField(read_only=True)
 
     class Meta:
         model = User
@@ -73,13 +75,11 @@ class CurrentUserSubscriptionsSeriazlizer(UserSerializer):
         )
 
     def get_recipes(self, obj):
-        request = self.context.get("request")
-        recipes_limit = request.query_params.get("recipes_limit")
-        if recipes_limit:
-            record = Recipe.objects.filter(author=obj)[: int(recipes_limit)]
-        else:
-            record = Recipe.objects.all()
-        return MiniRecipe(record, many=True).data
+        return MiniRecipe(obj.latest_recipes, many=True).data
+
+
+class ManageSubscribeSerializer(CurrentUserSubscriptionsSeriazlizer):
+    """Автор после подписки, в том же виде, что в списке подписок"""
 
 
 class IngredientSerializer(serializers.ModelSerializer):
@@ -95,7 +95,7 @@ class TagSerializer(serializers.ModelSerializer):
 
 
 class IngredientsInRecipeSerializer(serializers.ModelSerializer):
-    id = serializers.PrimaryKeyRelatedField(queryset=Ingredient.objects.all())
+    id = serializers.IntegerField()
     amount = serializers.IntegerField()
 
     class Meta:
@@ -103,11 +103,50 @@ class IngredientsInRecipeSerializer(serializers.ModelSerializer):
         fields = ("amount", "id")
 
 
+class CachedRecipeListSerializer(serializers.ListSerializer):
+    """Страница рецептов из общего кеша с флагами текущего пользователя.
+
+    Ответ без флагов одинаков для всех и кешируется по id рецепта,
+    updated_at и версиям тегов и ингредиентов. Промахи дочитывают
+    ингредиенты и теги одним запросом на всю страницу.
+    """
+
+    cache_timeout = 60 * 60 * 24
+
+    def to_representation(self, data):
+        recipes = list(data.all() if hasattr(data, "all") else data)
+        versions = (
+            get_cache_version(Tag._meta.label),
+            get_cache_version(Ingredient._meta.label),
+        )
+        keys = {
+            recipe.pk: "recipe_body:{}:{}:{}:{}".format(
+                recipe.pk, recipe.updated_at.timestamp(), *versions)
+            for recipe in recipes
+        }
+        bodies = cache.get_many(keys.values())
+        missing = [
+            recipe for recipe in recipes if keys[recipe.pk] not in bodies]
+        if missing:
+            prefetch_related_objects(missing, *recipe_prefetches())
+            rendered = {
+                keys[recipe.pk]: self.child.to_representation(recipe)
+                for recipe in missing
+            }
+            cache.set_many(rendered, self.cache_timeout)
+            bodies.update(rendered)
+        return [
+            self.child.with_user_flags(recipe, bodies[keys[recipe.pk]])
+            for recipe in recipes
+        ]
+
+
 class RecipeReadSerializer(serializers.ModelSerializer):
     author = UserSerializer(read_only=True, many=False)
     ingredients = serializers.SerializerMethodField("get_ingredients")
     tags = serializers.SerializerMethodField("get_tags")
     image = serializers.ReadOnlyField(source="image.url")
+    images = serializers.SerializerMethodField()
     is_favorited = serializers.SerializerMethodField("get_is_favorited")
     is_in_shopping_cart = serializers.SerializerMethodField(
         "get_is_in_shopping_cart")
@@ -118,6 +157,7 @@ class RecipeReadSerializer(serializers.ModelSerializer):
             "id",
             "author",
             "image",
+            "images",
             "tags",
             "cooking_time",
             "text",
@@ -126,16 +166,35 @@ class RecipeReadSerializer(serializers.ModelSerializer):
             "is_favorited",
             "is_in_shopping_cart",
         )
+        list_serializer_class = CachedRecipeListSerializer
+
+    def with_user_flags(self, obj, body):
+        """Копия общего ответа с флагами текущего пользователя"""
+        return {
+            **body,
+            "author": {
+                **body["author"],
+                "is_subscribed": (
+                    obj.author_id in get_subscribed_ids(self.context)),
+            },
+            "is_favorited": self.get_is_favorited(obj),
+            "is_in_shopping_cart": self.get_is_in_shopping_cart(obj),
+        }
+
+    def get_images(self, obj):
+        return rendition_urls(obj)
 
     def get_ingredients(self, obj):
-        record = RecipeIngredient.objects.filter(recipe=obj)
+        record = obj.recipe_with_ingredients.all()
         return IngredientsForRecipe(record, many=True).data
 
     def get_tags(self, obj):
-        record = RecipeTag.objects.filter(recipe=obj)
+        record = obj.tag_recipe.all()
         return TagsForRecipe(record, many=True).data
 
     def get_is_favorited(self, obj):
+        if hasattr(obj, "is_favorited"):
+            return obj.is_favorited
         request = self.context.get("request")
         user = request.user
         if user.is_anonymous:
@@ -143,6 +202,8 @@ class RecipeReadSerializer(serializers.ModelSerializer):
         return FavoriteRecipes.objects.filter(user=user, recipe=obj).exists()
 
     def get_is_in_shopping_cart(self, obj):
+        if hasattr(obj, "is_in_shopping_cart"):
+            return obj.is_in_shopping_cart
         request = self.context.get("request")
         user = request.user
         if user.is_anonymous:
@@ -153,9 +214,8 @@ class RecipeReadSerializer(serializers.ModelSerializer):
 class RecipeWriteSerializer(serializers.ModelSerializer):
     author = UserSerializer(read_only=True)
     ingredients = IngredientsInRecipeSerializer(many=True)
-    tags = serializers.PrimaryKeyRelatedField(
-        queryset=Tag.objects.all(), many=True)
-    image = Base64ImageField(use_url=True)
+    tags = BulkPrimaryKeyRelatedField(queryset=Tag.objects.all())
+    image = StreamingBase64ImageField()
     cooking_time = serializers.IntegerField()
 
     class Meta:
@@ -174,14 +234,27 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
             ]
         )
 
+    def validate_ingredients(self, ingredients_data):
+        """Все ингредиенты рецепта загружаются одним запросом"""
+        ingredient_ids = {ingredient["id"] for ingredient in ingredients_data}
+        found = Ingredient.objects.in_bulk(ingredient_ids)
+        missing = sorted(ingredient_ids - found.keys())
+        if missing:
+            raise serializers.ValidationError(
+                f"Ингредиенты с id {missing} не найдены"
+            )
+        for ingredient in ingredients_data:
+            ingredient["id"] = found[ingredient["id"]]
+        return ingredients_data
+
     def check_ingredients(self, ingredients_data):
-        ingredient_list = []
+        ingredient_set = set()
         for ingredient in ingredients_data:
-            if ingredient["id"] in ingredient_list:
+            if ingredient["id"] in ingredient_set:
                 raise serializers.ValidationError(
                     "Ингредиенты должны быть уникальными"
                 )
-            ingredient_list.append(ingredient["id"])
+            ingredient_set.add(ingredient["id"])
             if int(ingredient["amount"]) <= 0:
                 raise exceptions.ValidationError(
                     f"Количество ингредиента {ingredient['id']} "
@@ -189,63 +262,137 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
                 )
         return ingredients_data
 
+    def is_given(self, data, field):
+        """При PATCH проверяем только переданные поля"""
+        return not self.partial or field in data
+
     def validate(self, data):
         ingredients_data = data.get('ingredients')
         tags_data = data.get('tags')
-        if len(tags_data) != len(set(tags_data)):
+        if tags_data and len(tags_data) != len(set(tags_data)):
             raise serializers.ValidationError(
                 "Теги должны быть уникальными"
             )
 
-        if not data.get('name'):
+        if self.is_given(data, 'name') and not data.get('name'):
             raise serializers.ValidationError(
                 "Название рецепта не может быть пустым"
             )
-        if not data.get('tags'):
+        if self.is_given(data, 'tags') and not data.get('tags'):
             raise serializers.ValidationError(
                 "У рецепта должен быть хотя бы один тег"
             )
-        if not data.get('text'):
+        if self.is_given(data, 'text') and not data.get('text'):
             raise serializers.ValidationError(
                 "Описание рецепта не может быть пустым"
             )
         cooking_time = data.get('cooking_time')
-        if not cooking_time:
+        if self.is_given(data, 'cooking_time') and not cooking_time:
             raise serializers.ValidationError(
                 "У рецета должно быть указано время готовки"
             )
-        if int(cooking_time) < 0:
+        if cooking_time is not None and int(cooking_time) < 0:
             raise serializers.ValidationError(
                 "Время готовки должно быть положительным числом"
             )
-        self.check_ingredients(ingredients_data)
+        if ingredients_data is not None:
+            self.check_ingredients(ingredients_data)
 
         return data
 
+    @transaction.atomic
     def create(self, validated_data):
         ingredients_data = validated_data.pop("ingredients")
         tags_data = validated_data.pop("tags")
         request = self.context.get("request")
+        # Индекс поиска сигнал рецепта пересчитает после коммита,
+        # когда состав уже записан
         recipe = Recipe.objects.create(author=request.user, **validated_data)
-        recipe.save()
         recipe.tags.set(tags_data)
         self.bulk_create_ingredients(recipe, ingredients_data)
+        validated_data["image"].close()
         return recipe
 
+    def update_ingredients(self, recipe, ingredients_data):
+        """Меняет только отличающиеся строки RecipeIngredient.
+
+        Возвращает True, если состав рецепта изменился.
+        """
+        amounts = {
+            ingredient["id"].id: ingredient["amount"]
+            for ingredient in ingredients_data
+        }
+        existing = {
+            recipe_ingredient.ingredient_id: recipe_ingredient
+            for recipe_ingredient in RecipeIngredient.objects.filter(
+                recipe=recipe)
+        }
+        removed = [
+            recipe_ingredient.id
+            for ingredient_id, recipe_ingredient in existing.items()
+            if ingredient_id not in amounts
+        ]
+        changed = []
+        for ingredient_id, recipe_ingredient in existing.items():
+            amount = amounts.get(ingredient_id)
+            if amount is not None and recipe_ingredient.amount != amount:
+                recipe_ingredient.amount = amount
+                changed.append(recipe_ingredient)
+        added = [
+            RecipeIngredient(
+                recipe=recipe, ingredient_id=ingredient_id, amount=amount)
+            for ingredient_id, amount in amounts.items()
+            if ingredient_id not in existing
+        ]
+        if removed:
+            # Без post_delete на каждую строку: корзины, поиск и
+            # updated_at рецепта update() обновляет один раз
+            delete_rows(RecipeIngredient.objects.filter(id__in=removed))
+        if changed:
+            RecipeIngredient.objects.bulk_update(changed, ["amount"])
+        if added:
+            RecipeIngredient.objects.bulk_create(added)
+        return bool(removed or changed or added)
+
+    @transaction.atomic
     def update(self, instance: Recipe, validated_data):
-        instance.cooking_time = validated_data.get("cooking_time")
-        instance.name = validated_data.get("name")
-        instance.text = validated_data.get("text")
-        instance.tags.set(validated_data.get("tags"))
-        if validated_data.get("image"):
-            instance.image = validated_data.get("image")
-        ingredients_data = validated_data.pop("ingredients")
-        instance.ingredients.clear()
-        self.bulk_create_ingredients(instance, ingredients_data)
-        instance.save()
+        ingredients_data = validated_data.pop("ingredients", None)
+        tags_data = validated_data.pop("tags", None)
+        if tags_data is not None:
+            instance.tags.set(tags_data)
+        ingredients_changed = (
+            ingredients_data is not None
+            and self.update_ingredients(instance, ingredients_data)
+        )
+        image = validated_data.pop("image", None)
+        update_fields = [
+            field for field, value in validated_data.items()
+            if getattr(instance, field) != value
+        ]
+        for field in update_fields:
+            setattr(instance, field, validated_data[field])
+        if image:
+            instance.image = image
+            update_fields.append("image")
+        if update_fields:
+            instance.save(update_fields=update_fields + ["updated_at"])
+        elif ingredients_changed:
+            # Без save() сигналы не сработают, обновляем зависимое сами
+            invalidate_carts_with_recipe(instance.id)
+            recipes = Recipe.objects.filter(pk=instance.pk)
+            recipes.update_search_vector()
+            recipes.touch()
+        if image:
+            image.close()
         return instance
 
     def to_representation(self, instance):
+        request = self.context.get("request")
+        instance = (
+            Recipe.objects.with_related()
+            .with_user_flags(request and request.user)
+            .get(pk=instance.pk)
+        )
         return RecipeReadSerializer(instance, context=self.context).data
 
 
@@ -274,21 +421,12 @@ class TagsForRecipe(serializers.ModelSerializer):
 class MiniRecipe(RecipeReadSerializer):
     class Meta:
         model = Recipe
-        fields = ("id", "name", "image", "cooking_time")
+        fields = ("id", "name", "image", "images", "cooking_time")
 
 
-class AddToFavoriteSerializer(serializers.ModelSerializer):
-    def validate(self, data):
-        user = data["user"]
-        recipe = data["recipe"]
-        if FavoriteRecipes.objects.filter(user=user, recipe=recipe).exists():
-            raise serializers.ValidationError(
-                {"error": "Рецепт уже в избранном"})
-        return data
-
-    def to_representation(self, instance: FavoriteRecipes):
-        return MiniRecipe(instance.recipe).data
-
-    class Meta:
-        fields = ("user", "recipe")
-        model = FavoriteRecipes
+class RecipeIdsSerializer(serializers.Serializer):
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=settings.BULK_RECIPES_LIMIT,
+    )
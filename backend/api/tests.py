@@ -0,0 +1,489 @@
+import base64
+import shutil
+import tempfile
+from io import BytesIO
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models.signals import post_save
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from rest_framework.test import APIClient
+
+from recipes.models import (FavoriteRecipes, Ingredient, Recipe,
+                            RecipeIngredient, RecipeQuerySet, RecipeRanking,
+                            RecipeTag, ShoppingCart, Tag)
+from recipes.utils import insert_ignore
+from users.models import Follow
+
+User = get_user_model()
+
+
+def image_data():
+    buffer = BytesIO()
+    Image.new("RGB", (8, 8), (226, 108, 45)).save(buffer, "PNG")
+    return "data:image/png;base64," + base64.b64encode(
+        buffer.getvalue()).decode()
+
+
+def create_recipes(author, count, ingredients=3):
+    tags = Tag.objects.bulk_create(
+        Tag(name=f"тег {i}", slug=f"tag-{i}", color="#FF0000")
+        for i in range(2)
+    )
+    products = Ingredient.objects.bulk_create(
+        Ingredient(name=f"ингредиент {i}", measurement_unit="г")
+        for i in range(ingredients)
+    )
+    recipes = Recipe.objects.bulk_create(
+        Recipe(author=author, name=f"рецепт {i}", text="Смешать.",
+               cooking_time=10, image="media/recipe.jpg")
+        for i in range(count)
+    )
+    RecipeTag.objects.bulk_create(
+        RecipeTag(recipe=recipe, tag=tag)
+        for recipe in recipes for tag in tags)
+    RecipeIngredient.objects.bulk_create(
+        RecipeIngredient(recipe=recipe, ingredient=product, amount=100)
+        for recipe in recipes for product in products)
+    return recipes
+
+
+class RecipeListQueriesTest(TestCase):
+    """Страница рецептов стоит одинаковое число запросов при любом размере"""
+
+    page_sizes = (6, 50, 200)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create(
+            username="author", email="author@example.com")
+        cls.user = User.objects.create(
+            username="reader", email="reader@example.com")
+        recipes = create_recipes(cls.author, max(cls.page_sizes))
+        FavoriteRecipes.objects.bulk_create(
+            FavoriteRecipes(user=cls.user, recipe=recipe)
+            for recipe in recipes[::3])
+        ShoppingCart.objects.bulk_create(
+            ShoppingCart(user=cls.user, recipe=recipe)
+            for recipe in recipes[::4])
+
+    def count_queries(self, client, limit):
+        cache.clear()
+        with CaptureQueriesContext(connection) as context:
+            response = client.get("/api/recipes/", {"limit": limit})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()["results"]), limit)
+        return len(context.captured_queries)
+
+    def assert_constant(self, client):
+        counts = [self.count_queries(client, size) for size in self.page_sizes]
+        self.assertEqual(len(set(counts)), 1, counts)
+
+    def test_anonymous(self):
+        self.assert_constant(APIClient())
+
+    def test_authenticated(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        self.assert_constant(client)
+
+
+class RecipeUpdateQueriesTest(TestCase):
+    """Удаление строк состава не запускает обработку на каждую строку"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create(
+            username="author", email="author@example.com")
+        cls.recipe = create_recipes(cls.author, 1, ingredients=30)[0]
+        cls.products = list(Ingredient.objects.all())
+
+    def patch_queries(self, keep):
+        client = APIClient()
+        client.force_authenticate(self.author)
+        with CaptureQueriesContext(connection) as context:
+            response = client.patch(
+                f"/api/recipes/{self.recipe.pk}/",
+                {"ingredients": [
+                    {"id": product.id, "amount": keep}
+                    for product in self.products[:keep]
+                ]},
+                format="json",
+            )
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries)
+
+    def test_removed_ingredients_do_not_fan_out(self):
+        self.assertEqual(self.patch_queries(29), self.patch_queries(1))
+
+
+class CursorOrderingTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create(
+            username="author", email="author@example.com")
+        cls.recipes = create_recipes(author, 8, ingredients=1)
+        for count, recipe in enumerate(cls.recipes):
+            # Одинаковые счётчики парами: курсор должен пройти совпадения
+            recipe.favorites_count = count // 2
+        Recipe.objects.bulk_update(cls.recipes, ["favorites_count"])
+
+    def walk(self, params):
+        client = APIClient()
+        response = client.get(
+            "/api/recipes/", {"pagination": "cursor", "limit": 3, **params})
+        ids = []
+        while True:
+            self.assertEqual(response.status_code, 200)
+            ids += [recipe["id"] for recipe in response.json()["results"]]
+            if not response.json()["next"]:
+                return ids
+            response = client.get(response.json()["next"])
+
+    def test_default_ordering(self):
+        self.assertEqual(
+            self.walk({}), [recipe.id for recipe in self.recipes[::-1]])
+
+    def test_popular_ordering(self):
+        expected = [
+            recipe.id for recipe in sorted(
+                self.recipes,
+                key=lambda recipe: (recipe.favorites_count, recipe.id),
+                reverse=True,
+            )
+        ]
+        self.assertEqual(self.walk({"ordering": "popular"}), expected)
+
+    def test_expression_ordering_is_rejected(self):
+        response = APIClient().get(
+            "/api/recipes/", {"pagination": "cursor", "ordering": "trending"})
+        self.assertEqual(response.status_code, 400)
+
+
+class RecipeListETagTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create(
+            username="author", email="author@example.com")
+        cls.recipes = create_recipes(author, 3, ingredients=1)
+
+    def test_ranking_refresh_changes_etag(self):
+        client = APIClient()
+        params = {"ordering": "trending"}
+        etag = client.get("/api/recipes/", params)["ETag"]
+        self.assertEqual(client.get("/api/recipes/", params)["ETag"], etag)
+        # Пересчёт идёт в другом процессе, версии в кеше он не меняет
+        RecipeRanking.objects.create(recipe=self.recipes[0], trending=1)
+        self.assertNotEqual(
+            client.get("/api/recipes/", params)["ETag"], etag)
+
+    def test_unchanged_page_is_not_modified(self):
+        client = APIClient()
+        etag = client.get("/api/recipes/", {"limit": 2})["ETag"]
+        with CaptureQueriesContext(connection) as context:
+            response = client.get(
+                "/api/recipes/", {"limit": 2}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse(any(
+            "SUM(" in query["sql"] or "MAX(" in query["sql"]
+            for query in context.captured_queries
+        ))
+
+    def test_direct_tag_row_change_changes_etag(self):
+        client = APIClient()
+        recipe = self.recipes[0]
+        url = f"/api/recipes/{recipe.pk}/"
+        for path in (url, "/api/recipes/"):
+            with self.subTest(path=path):
+                etag = client.get(path)["ETag"]
+                # Как из RecipeTagAdmin: строка меняется мимо recipe.tags
+                RecipeTag.objects.filter(recipe=recipe).first().delete()
+                response = client.get(path, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 200)
+                self.assertNotEqual(response["ETag"], etag)
+
+    def test_count_change_on_other_page_changes_etag(self):
+        client = APIClient()
+        etag = client.get("/api/recipes/", {"limit": 1})["ETag"]
+        self.recipes[0].delete()
+        self.assertNotEqual(
+            client.get("/api/recipes/", {"limit": 1})["ETag"], etag)
+
+
+class SubscribeTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create(
+            username="author", email="author@example.com")
+        cls.user = User.objects.create(
+            username="reader", email="reader@example.com")
+        create_recipes(cls.author, 5, ingredients=1)
+
+    def test_subscribe_response_needs_no_extra_lookups(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        with CaptureQueriesContext(connection) as context:
+            response = client.post(
+                f"/api/users/{self.author.pk}/subscribe/?recipes_limit=2")
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(response.json()["is_subscribed"])
+        self.assertEqual(len(response.json()["recipes"]), 2)
+        # Подписки считаются только до и после вставки
+        follow_reads = [
+            query["sql"] for query in context.captured_queries
+            if query["sql"].startswith("SELECT")
+            and "users_follow" in query["sql"]
+            and "COUNT(*)" not in query["sql"]
+        ]
+        self.assertEqual(follow_reads, [])
+        selects = [
+            query for query in context.captured_queries
+            if query["sql"].startswith("SELECT")
+        ]
+        # Автор, два подсчёта подписок и последние рецепты
+        self.assertEqual(len(selects), 4)
+
+
+class FavoriteBulkTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create(
+            username="author", email="author@example.com")
+        cls.user = User.objects.create(
+            username="reader", email="reader@example.com")
+        cls.recipe, cls.other = create_recipes(author, 2, ingredients=1)
+        FavoriteRecipes.objects.create(user=cls.user, recipe=cls.recipe)
+
+    def post(self, recipe_ids):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.post(
+            "/api/recipes/favorite/", {"recipes": recipe_ids},
+            format="json")
+        self.assertEqual(response.status_code, 200)
+        return response.json()["results"]
+
+    def test_nothing_new_to_insert(self):
+        self.assertEqual(
+            self.post([self.recipe.pk]),
+            [{"id": self.recipe.pk, "status": "exists"}])
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.favorites_count, 1)
+
+    def test_missing_recipe(self):
+        self.assertEqual(
+            self.post([999999]), [{"id": 999999, "status": "not_found"}])
+
+    def test_insert_ignore_counts_new_rows_only(self):
+        rows = FavoriteRecipes.objects.filter(user=self.user)
+        with transaction.atomic():
+            created = insert_ignore(rows, [
+                FavoriteRecipes(user=self.user, recipe=self.recipe),
+                FavoriteRecipes(user=self.user, recipe=self.other),
+            ])
+        self.assertEqual(created, 1)
+        self.assertEqual(rows.count(), 2)
+
+    def test_insert_ignore_without_rows(self):
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(
+                insert_ignore(FavoriteRecipes.objects.all(), []), 0)
+        self.assertEqual(context.captured_queries, [])
+
+
+class ShoppingCartClearTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create(
+            username="author", email="author@example.com")
+        cls.user = User.objects.create(
+            username="reader", email="reader@example.com")
+        recipes = create_recipes(author, 3, ingredients=1)
+        ShoppingCart.objects.bulk_create(
+            ShoppingCart(user=cls.user, recipe=recipe) for recipe in recipes)
+
+    def delete(self, data):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        return client.delete(
+            "/api/recipes/shopping_cart/", data, format="json")
+
+    def test_missing_recipes_is_rejected(self):
+        for data in ({"recipe": [1]}, {}, {"clear": "true"}):
+            with self.subTest(data=data):
+                response = self.delete(data)
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(
+                    ShoppingCart.objects.filter(user=self.user).count(), 3)
+
+    def test_explicit_clear(self):
+        response = self.delete({"clear": True})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()["results"]), 3)
+        self.assertFalse(ShoppingCart.objects.filter(user=self.user).exists())
+
+
+class RecipeCreateTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create(
+            username="author", email="author@example.com")
+        cls.tag = Tag.objects.create(name="тег", slug="tag", color="#FF0000")
+        cls.ingredient = Ingredient.objects.create(
+            name="мука", measurement_unit="г")
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        # Копии картинки в пуле потоков пережили бы временный MEDIA_ROOT
+        pipeline = mock.patch("recipes.signals.get_pipeline")
+        pipeline.start()
+        self.addCleanup(pipeline.stop)
+
+    def test_recipe_is_saved_once(self):
+        saves = []
+
+        def count_saves(sender, **kwargs):
+            saves.append(kwargs["created"])
+
+        post_save.connect(count_saves, sender=Recipe)
+        self.addCleanup(post_save.disconnect, count_saves, sender=Recipe)
+        client = APIClient()
+        client.force_authenticate(self.author)
+        with mock.patch.object(
+            RecipeQuerySet, "update_search_vector", autospec=True
+        ) as update_search_vector:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = client.post("/api/recipes/", {
+                    "name": "рецепт", "text": "Смешать.", "cooking_time": 10,
+                    "image": image_data(), "tags": [self.tag.pk],
+                    "ingredients": [{"id": self.ingredient.pk, "amount": 5}],
+                }, format="json")
+        self.assertEqual(response.status_code, 201, response.json())
+        self.assertEqual(saves, [True])
+        self.assertEqual(update_search_vector.call_count, 1)
+
+
+class RecipeBodyCacheTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create(
+            username="author", email="author@example.com")
+        cls.recipe = create_recipes(author, 1, ingredients=1)[0]
+        cls.extra = Tag.objects.create(
+            name="ещё тег", slug="extra", color="#00FF00")
+
+    def setUp(self):
+        cache.clear()
+
+    def tag_ids(self):
+        response = APIClient().get("/api/recipes/")
+        return {tag["id"] for tag in response.json()["results"][0]["tags"]}
+
+    def test_direct_tag_row_change_resets_cached_body(self):
+        self.assertNotIn(self.extra.pk, self.tag_ids())
+        RecipeTag.objects.create(recipe=self.recipe, tag=self.extra)
+        self.assertIn(self.extra.pk, self.tag_ids())
+        RecipeTag.objects.filter(recipe=self.recipe, tag=self.extra).delete()
+        self.assertNotIn(self.extra.pk, self.tag_ids())
+
+
+class DeleteRowsTest(TestCase):
+    """Удаления без сигналов оставляют счётчики и кеши верными"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create(
+            username="author", email="author@example.com")
+        cls.user = User.objects.create(
+            username="reader", email="reader@example.com")
+        cls.recipes = create_recipes(cls.author, 2, ingredients=2)
+        for recipe in cls.recipes:
+            FavoriteRecipes.objects.create(user=cls.user, recipe=recipe)
+            ShoppingCart.objects.create(user=cls.user, recipe=recipe)
+        Follow.objects.create(user=cls.user, author=cls.author)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def flags(self):
+        return {
+            recipe["id"]: (
+                recipe["is_favorited"], recipe["is_in_shopping_cart"],
+                recipe["author"]["is_subscribed"],
+            )
+            for recipe in self.client.get("/api/recipes/").json()["results"]
+        }
+
+    def shopping_list(self):
+        response = self.client.get("/api/recipes/download_shopping_cart/")
+        return b"".join(response.streaming_content).decode()
+
+    def counters(self, recipe):
+        recipe = Recipe.objects.get(pk=recipe.pk)
+        return recipe.favorites_count, recipe.in_carts_count
+
+    def test_rows_deleted_raw_have_no_dependents(self):
+        for model in (FavoriteRecipes, ShoppingCart, Follow, RecipeIngredient):
+            with self.subTest(model=model):
+                self.assertEqual(model._meta.related_objects, ())
+
+    def test_single_deletes(self):
+        recipe, other = self.recipes
+        self.assertEqual(self.flags()[recipe.pk], (True, True, True))
+        self.assertIn("ингредиент 0", self.shopping_list())
+        for route in ("favorite", "shopping_cart"):
+            response = self.client.delete(
+                f"/api/recipes/{recipe.pk}/{route}/")
+            self.assertEqual(response.status_code, 204)
+        response = self.client.delete(
+            f"/api/users/{self.author.pk}/subscribe/")
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.counters(recipe), (0, 0))
+        self.assertEqual(self.counters(other), (1, 1))
+        self.assertEqual(
+            User.objects.get(pk=self.author.pk).followers_count, 0)
+        self.assertEqual(self.flags()[recipe.pk], (False, False, False))
+        self.assertIn("ингредиент 0 (г) - 100", self.shopping_list())
+
+    def test_bulk_deletes(self):
+        ids = [recipe.pk for recipe in self.recipes]
+        self.flags()
+        self.shopping_list()
+        for route in ("favorite", "shopping_cart"):
+            response = self.client.delete(
+                f"/api/recipes/{route}/", {"recipes": ids}, format="json")
+            self.assertEqual(response.status_code, 200)
+        for recipe in self.recipes:
+            self.assertEqual(self.counters(recipe), (0, 0))
+            self.assertEqual(self.flags()[recipe.pk][:2], (False, False))
+        self.assertEqual(self.shopping_list(), "")
+
+    def test_removed_ingredient_leaves_shopping_list(self):
+        recipe = self.recipes[0]
+        kept, removed = RecipeIngredient.objects.filter(
+            recipe=recipe).select_related("ingredient")
+        self.assertIn(
+            f"{removed.ingredient.name} (г) - 200", self.shopping_list())
+        etag = self.client.get(f"/api/recipes/{recipe.pk}/")["ETag"]
+        author = APIClient()
+        author.force_authenticate(self.author)
+        response = author.patch(
+            f"/api/recipes/{recipe.pk}/",
+            {"ingredients": [{"id": kept.ingredient_id, "amount": 100}]},
+            format="json")
+        self.assertEqual(response.status_code, 200)
+        shopping_list = self.shopping_list()
+        self.assertIn(f"{kept.ingredient.name} (г) - 200", shopping_list)
+        self.assertIn(f"{removed.ingredient.name} (г) - 100", shopping_list)
+        self.assertNotEqual(
+            self.client.get(f"/api/recipes/{recipe.pk}/")["ETag"], etag)
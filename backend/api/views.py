@@ -1,30 +1,41 @@
 from django.contrib.auth import get_user_model
-from django.shortcuts import HttpResponse, get_object_or_404
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Prefetch, Value
+from django.http import Http404, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet
 from rest_framework import status, viewsets
 from rest_framework.generics import ListAPIView
-from rest_framework.pagination import PageNumberPagination
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from recipes.models import (FavoriteRecipes, Ingredient, Recipe, ShoppingCart,
-                            Tag)
-from recipes.utils import make_shopping_cart
+from recipes.models import Ingredient, Recipe, Tag
+from recipes.utils import (SHOPPING_CART_FORMATS, change_counter,
+                           delete_rows, insert_ignore,
+                           invalidate_recipe_flags, make_shopping_cart)
 from users.models import Follow
 from .filters import IngredientNameSearchFilter, RecipeFilter
+from .mixins import (FavoritesMixin, RecipeConditionalGetMixin,
+                     ReferenceCacheMixin, ShoppingCartMixin)
+from .pagination import FeedPagination
+from .profiling import ProfiledViewMixin, registry
 from .permissions import IsAuthorOrStaffOrReadOnly
-from .serializers import (AddToFavoriteSerializer,
-                          CurrentUserSubscriptionsSeriazlizer,
+from .serializers import (CurrentUserSubscriptionsSeriazlizer,
                           IngredientSerializer, ManageSubscribeSerializer,
-                          MiniRecipe, RecipeReadSerializer,
-                          RecipeWriteSerializer, TagSerializer, UserSerializer)
+                          MiniRecipe, RecipeIdsSerializer,
+                          RecipeReadSerializer, RecipeWriteSerializer,
+                          TagSerializer, UserSerializer)
 
 User = get_user_model()
 
+# Поля рецептов, которые показываются в подписках
+SUBSCRIPTION_RECIPE_FIELDS = (
+    "id", "name", "image", "renditions", "cooking_time", "author")
 
-class CustomUserViewSet(UserViewSet):
+
+class CustomUserViewSet(ProfiledViewMixin, UserViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
     permission_classes = [
@@ -32,7 +43,7 @@ class CustomUserViewSet(UserViewSet):
     ]
 
 
-class ManageSubscribeView(APIView):
+class ManageSubscribeView(ProfiledViewMixin, APIView):
     permission_classes = [
         IsAuthenticated,
     ]
@@ -47,24 +58,44 @@ class ManageSubscribeView(APIView):
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
-        if Follow.objects.filter(user=follower, author=author).exists():
+        with transaction.atomic():
+            created = insert_ignore(
+                Follow.objects.filter(user=follower, author=author),
+                [Follow(user=follower, author=author)])
+            change_counter(
+                User.objects.filter(pk=author.pk), "followers_count", created)
+        if not created:
             return Response(
                 {"error": "Вы уже подписаны на данного пользователя"},
                 status=status.HTTP_400_BAD_REQUEST,
             )
-
-        Follow.objects.create(user=follower, author=author)
-        serializer = ManageSubscribeSerializer(author)
+        invalidate_recipe_flags(follower.id)
+        author.is_subscribed = True
+        recipes = Recipe.objects.filter(author=author).only(
+            *SUBSCRIPTION_RECIPE_FIELDS)
+        recipes_limit = request.query_params.get("recipes_limit")
+        if recipes_limit and recipes_limit.isdigit():
+            recipes = recipes[:int(recipes_limit)]
+        author.latest_recipes = list(recipes)
+        serializer = ManageSubscribeSerializer(
+            author, context={"request": request})
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
     def delete(self, request, user_id):
-        author = get_object_or_404(User, id=user_id)
         follower = request.user
 
-        follow = Follow.objects.filter(user=follower, author=author)
-        if follow.exists():
-            follow.delete()
+        # Без post_delete Follow: followers_count и флаги подписок
+        # обновляются здесь
+        with transaction.atomic():
+            deleted = delete_rows(
+                Follow.objects.filter(user=follower, author_id=user_id))
+            change_counter(
+                User.objects.filter(pk=user_id), "followers_count", -deleted)
+        if deleted:
+            invalidate_recipe_flags(follower.id)
             return Response(status=status.HTTP_204_NO_CONTENT)
+        if not User.objects.filter(pk=user_id).exists():
+            raise Http404
         return Response(
             {"error": "Подписка не найдена"},
             status=status.HTTP_400_BAD_REQUEST
@@ -76,32 +107,53 @@ class ManageSubscribeView(APIView):
         return Response(serializer.data)
 
 
-class CurrentUserSubscriptionsView(ListAPIView):
+class CurrentUserSubscriptionsView(ProfiledViewMixin, ListAPIView):
     permission_classes = [
         IsAuthenticated,
     ]
-    pagination_class = PageNumberPagination
+    pagination_class = FeedPagination
     serializer_class = CurrentUserSubscriptionsSeriazlizer
     allowed_methods = [
         "GET",
     ]
 
     def get_queryset(self):
-        return User.objects.filter(following__user=self.request.user)
+        user = self.request.user
+        followed = Follow.objects.filter(user=user)
+        recipes = Recipe.objects.filter(author__in=followed.values("author"))
+        recipes_limit = self.request.query_params.get("recipes_limit")
+        if recipes_limit and recipes_limit.isdigit():
+            recipes = recipes.latest_per_author(int(recipes_limit))
+        return (
+            User.objects.filter(
+                Exists(followed.filter(author=OuterRef("pk"))))
+            .annotate(is_subscribed=Value(True))
+            .prefetch_related(
+                Prefetch(
+                    "recipe_author",
+                    queryset=recipes.only(*SUBSCRIPTION_RECIPE_FIELDS),
+                    to_attr="latest_recipes",
+                )
+            )
+            .order_by("id")
+        )
 
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientViewSet(
+    ProfiledViewMixin, ReferenceCacheMixin, viewsets.ReadOnlyModelViewSet
+):
     serializer_class = IngredientSerializer
     permission_classes = [
         IsAuthorOrStaffOrReadOnly,
     ]
     queryset = Ingredient.objects.all()
     filter_backends = (IngredientNameSearchFilter,)
-    search_fields = ("^name",)
     pagination_class = None
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(
+    ProfiledViewMixin, RecipeConditionalGetMixin, viewsets.ModelViewSet
+):
     permission_classes = [
         IsAuthorOrStaffOrReadOnly,
     ]
@@ -110,6 +162,15 @@ class RecipeViewSet(viewsets.ModelViewSet):
         DjangoFilterBackend,
     ]
     filter_class = RecipeFilter
+    pagination_class = FeedPagination
+
+    def get_queryset(self):
+        if self.action == "list":
+            # Ингредиенты и теги нужны только промахам кеша страницы
+            recipes = Recipe.objects.select_related("author")
+        else:
+            recipes = Recipe.objects.with_related()
+        return recipes.with_user_flags(self.request.user)
 
     def get_serializer_class(self):
         if self.action in ("retrieve", "list"):
@@ -117,7 +178,9 @@ class RecipeViewSet(viewsets.ModelViewSet):
         return RecipeWriteSerializer
 
 
-class TagViewSet(viewsets.ReadOnlyModelViewSet):
+class TagViewSet(
+    ProfiledViewMixin, ReferenceCacheMixin, viewsets.ReadOnlyModelViewSet
+):
     serializer_class = TagSerializer
     queryset = Tag.objects.all()
     permission_classes = [
@@ -126,71 +189,191 @@ class TagViewSet(viewsets.ReadOnlyModelViewSet):
     pagination_class = None
 
 
-class FavoriteView(APIView):
-    permission_classes = [
-        IsAuthorOrStaffOrReadOnly,
-    ]
+class UserRecipeListView(ProfiledViewMixin, APIView):
+    """Рецепт в избранном или списке покупок текущего пользователя.
 
-    def post(self, request, recipe_id):
-        user = get_object_or_404(User, username=request.user.username)
-        recipe = get_object_or_404(Recipe, pk=recipe_id)
-        data = {"user": user.id, "recipe": recipe.id}
-        serializer = AddToFavoriteSerializer(
-            data=data, context={"request": request})
-        if not serializer.is_valid():
-            return Response(serializer.errors,
-                            status=status.HTTP_400_BAD_REQUEST)
-        serializer.save()
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
+    Повторные и одновременные запросы не падают на уникальности:
+    вставка идёт через ON CONFLICT DO NOTHING, удаление - одним DELETE.
+    """
 
-    def delete(self, request, recipe_id):
-        user = get_object_or_404(User, username=request.user.username)
-        recipe = get_object_or_404(Recipe, pk=recipe_id)
-        favorite = FavoriteRecipes.objects.filter(user=user, recipe=recipe)
-        if favorite.exists():
-            favorite.delete()
-            return Response(status=status.HTTP_204_NO_CONTENT)
-        return Response(
-            {"error": "Рецепт в списке избранных не найден"},
-            status=status.HTTP_400_BAD_REQUEST,
-        )
-
-
-class ShoppingCartView(APIView):
     permission_classes = [
         IsAuthenticated,
     ]
+    exists_error = None
+    missing_error = None
 
     def post(self, request, recipe_id):
-        user = get_object_or_404(User, username=request.user.username)
-        recipe = get_object_or_404(Recipe, pk=recipe_id)
-        if ShoppingCart.objects.filter(user=user, recipe=recipe).exists():
+        recipe = get_object_or_404(
+            Recipe.objects.only(
+                "id", "name", "image", "renditions", "cooking_time"),
+            pk=recipe_id,
+        )
+        with transaction.atomic():
+            created = insert_ignore(
+                self.model.objects.filter(user=request.user, recipe=recipe),
+                [self.model(user=request.user, recipe=recipe)])
+            change_counter(
+                Recipe.objects.filter(pk=recipe.pk), self.counter, created)
+        if not created:
             return Response(
-                {"error": "Рецепт уже в списке покупок"},
+                {"error": self.exists_error},
                 status=status.HTTP_400_BAD_REQUEST,
             )
-        ShoppingCart.objects.create(user=user, recipe=recipe)
+        self.invalidate(request.user)
         serializer = MiniRecipe(recipe)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
     def delete(self, request, recipe_id):
-        user = get_object_or_404(User, username=request.user.username)
-        recipe = get_object_or_404(Recipe, pk=recipe_id)
-        shopping_cart = ShoppingCart.objects.filter(user=user, recipe=recipe)
-        if shopping_cart.exists():
-            shopping_cart.delete()
+        # Без post_delete: счётчик рецепта и кеши пользователя
+        # (self.invalidate) обновляются здесь
+        with transaction.atomic():
+            deleted = delete_rows(
+                self.model.objects.filter(
+                    user=request.user, recipe_id=recipe_id))
+            change_counter(
+                Recipe.objects.filter(pk=recipe_id), self.counter, -deleted)
+        if deleted:
+            self.invalidate(request.user)
             return Response(status=status.HTTP_204_NO_CONTENT)
+        if not Recipe.objects.filter(pk=recipe_id).exists():
+            raise Http404
         return Response(
-            {"error": "Рецепт в списке покупок не найден"},
+            {"error": self.missing_error},
             status=status.HTTP_400_BAD_REQUEST,
         )
 
 
-class GetShoppingList(APIView):
+class FavoriteView(FavoritesMixin, UserRecipeListView):
+    exists_error = "Рецепт уже в избранном"
+    missing_error = "Рецепт в списке избранных не найден"
+
+
+class ShoppingCartView(ShoppingCartMixin, UserRecipeListView):
+    exists_error = "Рецепт уже в списке покупок"
+    missing_error = "Рецепт в списке покупок не найден"
+
+
+class UserRecipeBulkView(ProfiledViewMixin, APIView):
+    """Много рецептов за один запрос: {"recipes": [id, ...]}.
+
+    Id проверяются одним запросом, вставка и удаление идут одним
+    запросом; в ответе статус для каждого id в порядке запроса.
+    """
+
+    permission_classes = [
+        IsAuthenticated,
+    ]
+    # DELETE с {"clear": true} вместо списка очищает весь список
+    # пользователя; без списка и без флага - 400
+    allow_clear = False
+
+    def get_recipe_ids(self, request):
+        serializer = RecipeIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return list(dict.fromkeys(serializer.validated_data["recipes"]))
+
+    def results(self, recipe_ids, statuses):
+        return Response({
+            "results": [
+                {"id": pk, "status": statuses.get(pk, "not_found")}
+                for pk in recipe_ids
+            ]
+        })
+
+    def clear_requested(self, request):
+        return (
+            self.allow_clear
+            and "recipes" not in request.data
+            and request.data.get("clear") is True
+        )
+
+    def post(self, request):
+        recipe_ids = self.get_recipe_ids(request)
+        listed = dict(
+            Recipe.objects.filter(pk__in=recipe_ids)
+            .annotate(listed=Exists(self.model.objects.filter(
+                user=request.user, recipe=OuterRef("pk"))))
+            .values_list("pk", "listed")
+        )
+        new_ids = [pk for pk, is_listed in listed.items() if not is_listed]
+        if new_ids:
+            with transaction.atomic():
+                created = insert_ignore(self.model.objects.filter(
+                    user=request.user, recipe_id__in=new_ids), [
+                    self.model(user=request.user, recipe_id=pk)
+                    for pk in new_ids
+                ])
+                self.change_counters(new_ids, 1, created)
+            if created:
+                self.invalidate(request.user)
+        return self.results(recipe_ids, {
+            pk: "exists" if is_listed else "created"
+            for pk, is_listed in listed.items()
+        })
+
+    def delete(self, request):
+        rows = self.model.objects.filter(user=request.user)
+        if self.clear_requested(request):
+            recipe_ids = None
+        else:
+            recipe_ids = self.get_recipe_ids(request)
+            rows = rows.filter(recipe_id__in=recipe_ids)
+        listed = list(rows.values_list("recipe_id", flat=True))
+        # Без post_delete на каждую строку: счётчики рецептов и кеши
+        # пользователя обновляются здесь, по разу на запрос
+        with transaction.atomic():
+            deleted = delete_rows(self.model.objects.filter(
+                user=request.user, recipe_id__in=listed))
+            self.change_counters(listed, -1, deleted)
+        if deleted:
+            self.invalidate(request.user)
+        return self.results(
+            listed if recipe_ids is None else recipe_ids,
+            dict.fromkeys(listed, "deleted"),
+        )
+
+
+class FavoriteBulkView(FavoritesMixin, UserRecipeBulkView):
+    pass
+
+
+class ShoppingCartBulkView(ShoppingCartMixin, UserRecipeBulkView):
+    allow_clear = True
+
+
+class GetShoppingList(ProfiledViewMixin, APIView):
+    permission_classes = [
+        IsAuthenticated,
+    ]
+
     def get(self, request):
-        shopping_cart = make_shopping_cart(request)
-        response = HttpResponse(shopping_cart, "Content-Type: text/plain")
+        file_format = request.query_params.get("file_format", "txt")
+        if file_format not in SHOPPING_CART_FORMATS:
+            return Response(
+                {"error": "Поддерживаемые форматы: "
+                          + ", ".join(SHOPPING_CART_FORMATS)},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        content_type, shopping_cart = make_shopping_cart(
+            request.user, file_format)
+        response = StreamingHttpResponse(
+            shopping_cart, content_type=content_type)
         response["Content-Disposition"] = (
-            'attachment; filename="shopping_cart.txt"'
+            f'attachment; filename="shopping_cart.{file_format}"'
         )
         return response
+
+
+class ProfilingView(ProfiledViewMixin, APIView):
+    """Гистограммы ProfilingMiddleware; пусто, если профилирование выключено"""
+
+    permission_classes = [
+        IsAdminUser,
+    ]
+
+    def get(self, request):
+        return Response(registry.snapshot())
+
+    def delete(self, request):
+        registry.clear()
+        return Response(status=status.HTTP_204_NO_CONTENT)
@@ -55,6 +55,23 @@ MIDDLEWARE = [
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
 
+# Server-Timing и гистограмма /api/profiling/ по каждому эндпоинту
+API_PROFILING = os.getenv("API_PROFILING", default="False") == "True"
+API_PROFILING_WINDOW = int(os.getenv("API_PROFILING_WINDOW", default=1000))
+if API_PROFILING:
+    MIDDLEWARE.insert(0, "api.profiling.ProfilingMiddleware")
+# log - предупреждение в лог, raise - исключение (для разработки и тестов)
+API_QUERY_BUDGET_ACTION = os.getenv("API_QUERY_BUDGET_ACTION", default="log")
+# Эндпоинт (Класс.действие или весь класс) -> допустимое число запросов
+API_QUERY_BUDGETS = {
+    "RecipeViewSet.list": 7,
+    "RecipeViewSet.retrieve": 6,
+    "CurrentUserSubscriptionsView": 5,
+    "GetShoppingList": 3,
+    "IngredientViewSet": 2,
+    "TagViewSet": 2,
+}
+
 ROOT_URLCONF = "backend.urls"
 
 TEMPLATES = [
@@ -91,6 +108,21 @@ DATABASES = {
 }
 
 
+# Версии кешей (справочники, флаги пользователей, списки покупок) лежат
+# в самом кеше. Если процессов несколько - воркеры gunicorn, importcsv -
+# нужен общий бэкенд (Redis, Memcached); LocMemCache годится только для
+# одного процесса. manage.py check --deploy предупреждает об этом.
+CACHES = {
+    "default": {
+        "BACKEND": os.getenv(
+            "CACHE_BACKEND",
+            default="django.core.cache.backends.locmem.LocMemCache",
+        ),
+        "LOCATION": os.getenv("CACHE_LOCATION", default="foodgram"),
+    }
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
 
@@ -133,6 +165,30 @@ STATIC_ROOT = os.path.join(BASE_DIR, "static")
 MEDIA_URL = "/"
 MEDIA_ROOT = os.path.join(BASE_DIR, "")
 
+INGREDIENT_SEARCH_BACKEND = os.getenv(
+    "INGREDIENT_SEARCH_BACKEND", default="auto")
+INGREDIENT_SEARCH_LIMIT = int(os.getenv("INGREDIENT_SEARCH_LIMIT", default=20))
+
+# thread - пул потоков, queue - очередь для тестов, sync - прямо в запросе
+IMAGE_PIPELINE = os.getenv("IMAGE_PIPELINE", default="thread")
+IMAGE_PIPELINE_WORKERS = int(os.getenv("IMAGE_PIPELINE_WORKERS", default=2))
+
+RECIPE_SEARCH_CONFIG = os.getenv("RECIPE_SEARCH_CONFIG", default="russian")
+
+# Сколько рецептов можно добавить в избранное или список покупок за запрос
+BULK_RECIPES_LIMIT = int(os.getenv("BULK_RECIPES_LIMIT", default=100))
+
+# Вес события в trending убывает вдвое за это время
+RECIPE_TRENDING_HALF_LIFE_HOURS = float(
+    os.getenv("RECIPE_TRENDING_HALF_LIFE_HOURS", default=72))
+RECIPE_TRENDING_CART_WEIGHT = float(
+    os.getenv("RECIPE_TRENDING_CART_WEIGHT", default=0.5))
+
+SHOPPING_CART_PDF_FONT = os.getenv(
+    "SHOPPING_CART_PDF_FONT",
+    default="/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+)
+
 
 # API
 REST_FRAMEWORK = {
@@ -142,9 +198,12 @@ REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": [
         "rest_framework.authentication.TokenAuthentication",
     ],
-    "DEFAULT_PAGINATION_CLASS": "rest_framework.pagination.PageNumberPagination",
+    "DEFAULT_PAGINATION_CLASS": "api.pagination.FoodgramPagination",
+    "DEFAULT_RENDERER_CLASSES": [
+        "api.renderers.FastJSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ],
     "PAGE_SIZE": 6,
-    "page_size_query_param": "limit",
 }
 
 SIMPLE_JWT = {"ACCESS_TOKEN_LIFETIME": timedelta(days=7)}
@@ -153,6 +212,8 @@ DJOSER = {
     "LOGIN_FIELD": "email",
     "SERIALIZERS": {
         "user_create": "api.serializers.UserSerializer",
+        "user": "api.serializers.UserSerializer",
+        "current_user": "api.serializers.UserSerializer",
         "set_password": "djoser.serializers.SetPasswordSerializer",
     },
 }
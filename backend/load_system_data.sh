@@ -1,3 +1,5 @@
 python manage.py makemigrations --no-input
 python manage.py migrate --no-input
-python manage.py collectstatic --no-input
\ No newline at end of file
+python manage.py collectstatic --no-input
+python manage.py importcsv data/ingredients.csv Ingredient
+
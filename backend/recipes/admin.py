@@ -1,4 +1,5 @@
 from django.contrib import admin
+from django.contrib.admin.views.main import PAGE_VAR
 from django.forms.models import BaseInlineFormSet
 
 from .models import (FavoriteRecipes, Ingredient, Recipe, RecipeIngredient,
@@ -12,9 +13,36 @@ class RequiredInlineFormSet(BaseInlineFormSet):
         return form
 
 
+class AuthorFilter(admin.SimpleListFilter):
+    """Автор вводится по username, список всех авторов не загружается"""
+
+    title = "автору"
+    parameter_name = "author"
+    template = "admin/input_filter.html"
+
+    def lookups(self, request, model_admin):
+        # Вариантов нет: username вводится в поле шаблона
+        return ()
+
+    def has_output(self):
+        return True
+
+    def choices(self, changelist):
+        query_params = dict(changelist.params)
+        query_params.pop(self.parameter_name, None)
+        query_params.pop(PAGE_VAR, None)
+        yield {"query_params": query_params, "value": self.value() or ""}
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(author__username=self.value())
+        return queryset
+
+
 class RecipeIngredientInline(admin.TabularInline):
     model = Recipe.ingredients.through
     formset = RequiredInlineFormSet
+    autocomplete_fields = ("ingredient",)
     extra = 1
     min_num = 1
 
@@ -43,10 +71,19 @@ class RecipeAdmin(admin.ModelAdmin):
         "author__username",
         "tags__name",
     )
-    list_filter = ("author", "name", "tags")
+    list_filter = (AuthorFilter, "tags")
+    raw_id_fields = ("author",)
+    show_full_result_count = False
     empty_value_display = "-пусто-"
     inlines = (RecipeTagInline, RecipeIngredientInline)
 
+    def get_queryset(self, request):
+        return (
+            super().get_queryset(request)
+            .select_related("author")
+            .prefetch_related("ingredients", "tags")
+        )
+
     @admin.display(description="ингредиенты")
     def get_ingredients(self, obj):
         return ", ".join(
@@ -59,7 +96,7 @@ class RecipeAdmin(admin.ModelAdmin):
 
     @admin.display(description="добавлено в избранное")
     def get_favorites(self, obj):
-        return obj.favorites_recipe.count()
+        return obj.favorites_count
 
 
 class IngredientAdmin(admin.ModelAdmin):
@@ -71,26 +108,39 @@ class IngredientAdmin(admin.ModelAdmin):
 class TagAdmin(admin.ModelAdmin):
     list_display = ("id", "name", "color", "slug")
     list_editable = ("name", "color", "slug")
+    search_fields = ("name", "slug")
 
 
 class RecipeTagAdmin(admin.ModelAdmin):
     list_display = ("id", "recipe", "tag")
     list_editable = ("recipe", "tag")
+    list_select_related = ("recipe", "tag")
+    autocomplete_fields = ("recipe", "tag")
+    show_full_result_count = False
 
 
 class RecipeIngredientAdmin(admin.ModelAdmin):
     list_display = ("id", "recipe", "ingredient", "amount")
     list_editable = ("recipe", "ingredient", "amount")
+    list_select_related = ("recipe", "ingredient")
+    autocomplete_fields = ("recipe", "ingredient")
+    show_full_result_count = False
 
 
 class FavoriteRecipesAdmin(admin.ModelAdmin):
-    list_display = ("id", "recipe", "user")
+    list_display = ("id", "recipe", "user", "created_at")
     list_editable = ("recipe", "user")
+    list_select_related = ("recipe", "user")
+    autocomplete_fields = ("recipe", "user")
+    show_full_result_count = False
 
 
 class ShoppingCartAdmin(admin.ModelAdmin):
-    list_display = ("id", "recipe", "user")
+    list_display = ("id", "recipe", "user", "created_at")
     list_editable = ("recipe", "user")
+    list_select_related = ("recipe", "user")
+    autocomplete_fields = ("recipe", "user")
+    show_full_result_count = False
 
 
 admin.site.register(Recipe, RecipeAdmin)
@@ -0,0 +1,28 @@
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+
+# Кеши, которые видит только процесс, записавший в них
+LOCAL_CACHES = ("django.core.cache.backends.locmem.LocMemCache",)
+
+
+def cache_is_shared():
+    return settings.CACHES["default"]["BACKEND"] not in LOCAL_CACHES
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    """Версии кешей справочников и флагов хранятся в кеше.
+
+    С кешем в памяти процесса изменение в одном воркере или
+    в management-команде не доходит до остальных воркеров.
+    """
+    if cache_is_shared():
+        return []
+    return [
+        Warning(
+            "Кеш в памяти процесса: воркеры не видят сброс версий "
+            "тегов, ингредиентов и флагов друг друга и importcsv",
+            hint="CACHE_BACKEND=django.core.cache.backends.redis.RedisCache",
+            id="recipes.W001",
+        )
+    ]
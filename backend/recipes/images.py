@@ -0,0 +1,129 @@
+import logging
+import os
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, connection
+from django.utils import timezone
+from PIL import Image, features
+
+logger = logging.getLogger(__name__)
+
+# Наибольшая сторона картинки для каждого места показа
+RENDITIONS = {
+    "card": 240,
+    "list": 480,
+    "detail": 1024,
+}
+RENDITIONS_DIR = "media/renditions"
+
+
+def rendition_format():
+    return ("WEBP", "webp") if features.check("webp") else ("JPEG", "jpg")
+
+
+def make_renditions(recipe_id, image_name):
+    """Уменьшенные копии картинки рецепта, пути пишутся в renditions"""
+    from .models import Recipe
+
+    # Копии лежат в том же хранилище, что и картинка рецепта
+    storage = Recipe._meta.get_field("image").storage
+    image_format, extension = rendition_format()
+    stem = os.path.splitext(os.path.basename(image_name))[0]
+    renditions = {"source": image_name}
+    with storage.open(image_name, "rb") as source:
+        original = Image.open(source)
+        original.load()
+    if original.mode not in ("RGB", "RGBA"):
+        original = original.convert("RGBA")
+    if image_format == "JPEG" and original.mode == "RGBA":
+        original = original.convert("RGB")
+    for size_name, size in RENDITIONS.items():
+        name = f"{RENDITIONS_DIR}/{stem}_{size_name}.{extension}"
+        if not storage.exists(name):
+            image = original.copy()
+            image.thumbnail((size, size))
+            buffer = BytesIO()
+            image.save(buffer, image_format, quality=80)
+            name = storage.save_derived(
+                name, ContentFile(buffer.getvalue()))
+        renditions[size_name] = name
+    # Картинку могли заменить, пока шла обработка: тогда не трогаем
+    Recipe.objects.filter(pk=recipe_id, image=image_name).update(
+        renditions=renditions, updated_at=timezone.now())
+
+
+def process(recipe_id, image_name):
+    try:
+        make_renditions(recipe_id, image_name)
+    except Exception:
+        logger.exception("Не удалось обработать картинку %s", image_name)
+
+
+def run_task(recipe_id, image_name):
+    close_old_connections()
+    try:
+        process(recipe_id, image_name)
+    finally:
+        connection.close()
+
+
+class ThreadPipeline:
+    """Обработка в пуле потоков процесса, запрос её не ждёт"""
+
+    def __init__(self, workers):
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="recipe-images")
+
+    def submit(self, recipe_id, image_name):
+        self.executor.submit(run_task, recipe_id, image_name)
+
+
+class ImmediatePipeline:
+    def submit(self, recipe_id, image_name):
+        process(recipe_id, image_name)
+
+
+class QueuePipeline:
+    """Очередь в памяти вместо пула: задачи выполняет drain()"""
+
+    def __init__(self):
+        self.tasks = queue.Queue()
+
+    def submit(self, recipe_id, image_name):
+        self.tasks.put((recipe_id, image_name))
+
+    def drain(self):
+        while not self.tasks.empty():
+            process(*self.tasks.get())
+
+
+_pipeline = None
+
+
+def get_pipeline():
+    global _pipeline
+    if _pipeline is None:
+        backend = settings.IMAGE_PIPELINE
+        if backend == "thread":
+            _pipeline = ThreadPipeline(settings.IMAGE_PIPELINE_WORKERS)
+        elif backend == "queue":
+            _pipeline = QueuePipeline()
+        else:
+            _pipeline = ImmediatePipeline()
+    return _pipeline
+
+
+def rendition_urls(recipe):
+    """URL копий картинки; пока копия не готова - URL оригинала"""
+    renditions = recipe.renditions or {}
+    if renditions.get("source") != recipe.image.name:
+        renditions = {}
+    return {
+        size_name: recipe.image.storage.url(
+            renditions.get(size_name, recipe.image.name))
+        for size_name in RENDITIONS
+    }
@@ -0,0 +1,220 @@
+import csv
+import json
+import os
+import random
+from datetime import timedelta
+from io import BytesIO
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.utils import timezone
+from PIL import Image
+
+from recipes.models import Ingredient, Recipe, RecipeIngredient, RecipeTag, Tag
+from recipes.storage import image_storage
+from recipes.utils import percentile
+
+User = get_user_model()
+
+FILE_FORMATS = ("csv", "json")
+COLORS = ("#E26C2D", "#49B64E", "#8775D2", "#F0C419", "#3D8FD1", "#D64550")
+# Сколько ингредиентов в рецепте: от и до
+INGREDIENTS_PER_RECIPE = [3, 12]
+DISHES = (
+    "суп", "салат", "пирог", "запеканка", "рагу", "каша", "омлет",
+    "блины", "котлеты", "паста", "плов", "соус", "десерт", "смузи",
+)
+
+
+def detect_format(file_path):
+    extension = os.path.splitext(file_path)[1].lstrip(".").lower()
+    return extension if extension in FILE_FORMATS else "csv"
+
+
+def read_rows(file_path, file_format, delimiter=","):
+    """Возвращает заголовок и итератор по строкам файла.
+
+    CSV читается построчно; JSON ожидается списком объектов
+    с одинаковым набором ключей.
+    """
+    if file_format == "json":
+        with open(file_path, "r", encoding="utf-8") as json_file:
+            objects = json.load(json_file)
+        if not objects:
+            return [], iter(())
+        header = list(objects[0])
+        return header, (
+            tuple(obj[key] for key in header) for obj in objects)
+
+    def csv_rows():
+        with open(file_path, "r", encoding="utf-8", newline="") as csv_file:
+            reader = csv.reader(csv_file, delimiter=delimiter)
+            next(reader, None)
+            for row in reader:
+                if row:
+                    yield tuple(row)
+
+    with open(file_path, "r", encoding="utf-8", newline="") as csv_file:
+        header = next(csv.reader(csv_file, delimiter=delimiter), [])
+    return header, csv_rows()
+
+
+def batched(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def timing_summary(timings):
+    """p50/p95/max в миллисекундах"""
+    return {
+        "count": len(timings),
+        "p50_ms": round(percentile(timings, 50) * 1000, 3),
+        "p95_ms": round(percentile(timings, 95) * 1000, 3),
+        "max_ms": round(max(timings, default=0) * 1000, 3),
+    }
+
+
+class SyntheticDataset:
+    """Синтетические данные generatedata и бенчмарков.
+
+    Строки создаются bulk_create без сигналов: счётчики и search_vector
+    пересчитывает вызывающий код. Имена строк начинаются с prefix.
+    """
+
+    def __init__(self, prefix, seed=1, batch_size=5000, days=30):
+        self.prefix = prefix
+        self.random = random.Random(seed)
+        self.batch_size = batch_size
+        self.now = timezone.now()
+        self.days = days
+        self.image = None
+
+    def load_ingredients(self, file_path):
+        if Ingredient.objects.exists():
+            return
+        header, rows = read_rows(file_path, "csv")
+        for batch in batched(rows, self.batch_size):
+            Ingredient.objects.bulk_create(
+                Ingredient(**dict(zip(header, row))) for row in batch)
+
+    def make_image(self):
+        """Общая картинка рецептов.
+
+        Хранилище называет файл по хешу содержимого и не пишет его
+        повторно, если файл с таким именем уже есть.
+        """
+        buffer = BytesIO()
+        Image.new("RGB", (1024, 768), (226, 108, 45)).save(buffer, "JPEG")
+        self.image = image_storage.save(
+            f"media/{self.prefix}.jpg", ContentFile(buffer.getvalue()))
+        return self.image
+
+    def created_at(self):
+        return self.now - timedelta(seconds=self.random.random() * (
+            self.days * 24 * 3600))
+
+    def make_users(self, count):
+        password = make_password(None)
+        users = []
+        for batch in batched(range(count), self.batch_size):
+            users.extend(User.objects.bulk_create(
+                User(username=f"{self.prefix}_{i}",
+                     email=f"{self.prefix}_{i}@example.com",
+                     first_name=f"Имя {i}", last_name=f"Фамилия {i}",
+                     password=password)
+                for i in batch
+            ))
+        return users
+
+    def make_tags(self, count):
+        return Tag.objects.bulk_create(
+            Tag(name=f"тег {i}", slug=f"{self.prefix}-{i}",
+                color=COLORS[i % len(COLORS)])
+            for i in range(count)
+        )
+
+    def make_recipes(self, authors, per_author, tags=(),
+                     ingredients_range=(0, 0)):
+        """Рецепты с 1-3 тегами и случайным составом.
+
+        Название - блюдо и первый ингредиент, текст перечисляет
+        состав: поиску есть что находить.
+        """
+        ingredients = (
+            list(Ingredient.objects.values_list("id", "name"))
+            if ingredients_range[1] else []
+        )
+        recipes = []
+        keys = [author for author in authors for _ in range(per_author)]
+        for batch in batched(keys, self.batch_size):
+            chosen = [self.pick_ingredients(ingredients, ingredients_range)
+                      for _ in batch]
+            created = Recipe.objects.bulk_create(
+                self.make_recipe(author, picked)
+                for author, picked in zip(batch, chosen)
+            )
+            if tags:
+                RecipeTag.objects.bulk_create(
+                    RecipeTag(recipe=recipe, tag=tag)
+                    for recipe in created
+                    for tag in self.random.sample(
+                        tags, self.random.randint(1, min(3, len(tags))))
+                )
+            RecipeIngredient.objects.bulk_create(
+                RecipeIngredient(recipe=recipe, ingredient_id=ingredient_id,
+                                 amount=self.random.randint(1, 500))
+                for recipe, picked in zip(created, chosen)
+                for ingredient_id, _ in picked
+            )
+            recipes.extend(created)
+        return recipes
+
+    def pick_ingredients(self, ingredients, ingredients_range):
+        low, high = ingredients_range
+        return self.random.sample(
+            ingredients, min(len(ingredients), self.random.randint(low, high)))
+
+    def make_recipe(self, author, ingredients):
+        name = self.random.choice(DISHES)
+        if ingredients:
+            name = f"{name} {ingredients[0][1]}"
+        return Recipe(
+            author=author, name=name[:50],
+            text=", ".join(ingredient for _, ingredient in ingredients)
+            + ". Нарезать, смешать и запечь.",
+            cooking_time=self.random.randint(5, 180),
+            image=self.image, created_at=self.created_at(),
+        )
+
+    def make_links(self, model, target_field, users, targets, per_user):
+        """Связи пользователь -> цель; популярность целей по Ципфу"""
+        weights = [1 / (rank + 1) for rank in range(len(targets))]
+        self_links = target_field == "author"
+        timestamped = any(
+            field.name == "created_at" for field in model._meta.fields)
+        rows = []
+        for user in users:
+            chosen = {
+                target.pk
+                for target in self.random.choices(
+                    targets, weights, k=per_user)
+            }
+            if self_links:
+                chosen.discard(user.pk)
+            rows.extend((user.pk, target_id) for target_id in chosen)
+        for batch in batched(rows, self.batch_size):
+            links = [
+                model(user_id=user_id, **{f"{target_field}_id": target_id})
+                for user_id, target_id in batch
+            ]
+            if timestamped:
+                for link in links:
+                    link.created_at = self.created_at()
+            model.objects.bulk_create(links)
@@ -0,0 +1,196 @@
+import json
+import subprocess
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from recipes.models import FavoriteRecipes, Recipe, ShoppingCart, Tag
+from recipes.utils import percentile
+from users.models import Follow
+from ._private import timing_summary
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        'Drives the API routes through the test client on the current '
+        'database (see generatedata) and saves latency and query counts '
+        'per endpoint as JSON'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=30)
+        parser.add_argument(
+            '--cold', action='store_true',
+            help='Clear the cache before every request'
+        )
+        parser.add_argument('--output', default='bench_api.json')
+        parser.add_argument(
+            '--compare', help='Previous results file to print deltas against'
+        )
+
+    def handle(self, *args, **options):
+        self.cold = options["cold"]
+        user = (
+            User.objects.annotate(activity=Count("favorites_user"))
+            .order_by("-activity", "id").first()
+        )
+        recipe = Recipe.objects.order_by("-favorites_count", "-id").first()
+        tag = Tag.objects.order_by("id").first()
+        if user is None or recipe is None or tag is None:
+            raise CommandError('No data to benchmark, run generatedata')
+        token, _ = Token.objects.get_or_create(user=user)
+        self.anonymous = APIClient()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {token.key}")
+        results = {}
+        for name, client, method, path in self.endpoints(user, recipe, tag):
+            results[name] = self.measure(
+                client, method, path, options["repeat"])
+            self.stdout.write(
+                f'{name}: {results[name]["status"]} '
+                f'p50 {results[name]["latency_ms"]["p50_ms"]} ms '
+                f'p95 {results[name]["latency_ms"]["p95_ms"]} ms, '
+                f'{results[name]["queries"]["p50"]} queries'
+            )
+        report = {
+            "commit": self.commit(),
+            "created_at": timezone.now().isoformat(),
+            "database": connection.vendor,
+            "cold_cache": self.cold,
+            "repeat": options["repeat"],
+            "dataset": {
+                "users": User.objects.count(),
+                "recipes": Recipe.objects.count(),
+                "follows": Follow.objects.count(),
+                "favorites": FavoriteRecipes.objects.count(),
+                "carts": ShoppingCart.objects.count(),
+            },
+            "endpoints": results,
+        }
+        with open(options["output"], "w", encoding="utf-8") as output:
+            json.dump(report, output, ensure_ascii=False, indent=2)
+        self.stdout.write(self.style.SUCCESS(
+            f'Results saved to {options["output"]}'))
+        if options["compare"]:
+            self.compare(options["compare"], report)
+
+    def endpoints(self, user, recipe, tag):
+        # Рецепт и автор, которых у пользователя ещё нет: запись
+        # и удаление идут парами и оставляют данные как были
+        free_recipe = Recipe.objects.exclude(
+            favorites_recipe__user=user).exclude(
+            carts_recipe__user=user).order_by("id").first()
+        free_author = User.objects.exclude(pk=user.pk).exclude(
+            following__user=user).order_by("id").first()
+        client, anonymous = self.client, self.anonymous
+        endpoints = [
+            ("recipes.list.anonymous", anonymous, "get", "/api/recipes/"),
+            ("recipes.list", client, "get", "/api/recipes/"),
+            ("recipes.list.limit50", client, "get", "/api/recipes/?limit=50"),
+            ("recipes.list.tags", client, "get",
+             f"/api/recipes/?tags={tag.slug}"),
+            ("recipes.list.favorited", client, "get",
+             "/api/recipes/?is_favorited=1"),
+            ("recipes.list.in_cart", client, "get",
+             "/api/recipes/?is_in_shopping_cart=1"),
+            ("recipes.list.author", client, "get",
+             f"/api/recipes/?author={recipe.author_id}"),
+            ("recipes.list.popular", client, "get",
+             "/api/recipes/?ordering=popular"),
+            ("recipes.list.search", client, "get",
+             "/api/recipes/?search=рецепт"),
+            ("recipes.retrieve", client, "get", f"/api/recipes/{recipe.pk}/"),
+            ("subscriptions", client, "get",
+             "/api/users/subscriptions/?recipes_limit=3"),
+            ("shopping_cart.download", client, "get",
+             "/api/recipes/download_shopping_cart/"),
+            ("tags", anonymous, "get", "/api/tags/"),
+            ("ingredients.search", anonymous, "get",
+             "/api/ingredients/?name=са"),
+            ("users.list", client, "get", "/api/users/"),
+            ("users.me", client, "get", "/api/users/me/"),
+        ]
+        if free_recipe is not None:
+            for route in ("favorite", "shopping_cart"):
+                path = f"/api/recipes/{free_recipe.pk}/{route}/"
+                endpoints += [
+                    (f"{route}.add", client, "post", path),
+                    (f"{route}.remove", client, "delete", path),
+                ]
+        if free_author is not None:
+            path = f"/api/users/{free_author.pk}/subscribe/"
+            endpoints += [
+                ("subscribe.add", client, "post", path),
+                ("subscribe.remove", client, "delete", path),
+            ]
+        return endpoints
+
+    def request(self, client, method, path):
+        if self.cold:
+            cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            response = getattr(client, method)(path)
+            if response.streaming:
+                b"".join(response.streaming_content)
+            elapsed = time.perf_counter() - started
+        return response.status_code, elapsed, len(queries.captured_queries)
+
+    def measure(self, client, method, path, repeat):
+        statuses, timings, queries = set(), [], []
+        for _ in range(repeat):
+            # Удаление замеряем после добавления, добавление - перед
+            # удалением: данные остаются в исходном состоянии
+            if method == "delete":
+                self.request(client, "post", path)
+            status, elapsed, count = self.request(client, method, path)
+            if method == "post":
+                self.request(client, "delete", path)
+            statuses.add(status)
+            timings.append(elapsed)
+            queries.append(count)
+        return {
+            "method": method.upper(),
+            "path": path,
+            "status": sorted(statuses),
+            "latency_ms": timing_summary(timings),
+            "queries": {
+                "p50": percentile(queries, 50),
+                "max": max(queries, default=0),
+            },
+        }
+
+    def commit(self):
+        try:
+            return subprocess.run(
+                ["git", "rev-parse", "--short", "HEAD"],
+                capture_output=True, text=True, check=True,
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def compare(self, path, report):
+        with open(path, encoding="utf-8") as previous_file:
+            previous = json.load(previous_file)
+        self.stdout.write(
+            f'Compared with {previous.get("commit")} '
+            f'({previous.get("created_at")}):')
+        for name, result in report["endpoints"].items():
+            before = previous["endpoints"].get(name)
+            if before is None:
+                continue
+            self.stdout.write(
+                f'{name}: p50 {before["latency_ms"]["p50_ms"]} -> '
+                f'{result["latency_ms"]["p50_ms"]} ms, queries '
+                f'{before["queries"]["p50"]} -> {result["queries"]["p50"]}'
+            )
@@ -0,0 +1,76 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from recipes.models import Ingredient
+from recipes.search import ENGINES
+from ._private import read_rows, timing_summary
+
+TYPICAL_WORDS = (
+    "молоко", "сахар", "мука пшеничная", "яйца куриные", "соль",
+    "масло сливочное", "картофель", "лук репчатый", "чеснок", "сыр",
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmarks ingredient autocomplete with keystroke sequences. '
+        'Missing ingredients are loaded from the file and rolled back'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--file', default='data/ingredients.csv',
+            help='Ingredients csv-file'
+        )
+        parser.add_argument(
+            '--words', type=int, default=50,
+            help='Random ingredient names typed in addition to typical ones'
+        )
+        parser.add_argument('--limit', type=int, default=20)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        header, rows = read_rows(options["file"], "csv")
+        names = [dict(zip(header, row))["name"] for row in rows]
+        random.seed(options["seed"])
+        words = list(TYPICAL_WORDS) + random.sample(
+            names, min(options["words"], len(names)))
+        keystrokes = [
+            word[:length]
+            for word in words
+            for length in range(1, min(len(word), 10) + 1)
+        ]
+
+        engines = ["memory"]
+        if connection.vendor == "postgresql":
+            engines.append("postgres")
+
+        with transaction.atomic():
+            if not Ingredient.objects.exists():
+                _, rows = read_rows(options["file"], "csv")
+                Ingredient.objects.bulk_create(
+                    Ingredient(**dict(zip(header, row))) for row in rows)
+            for name in engines:
+                self.run(name, ENGINES[name], keystrokes, options["limit"])
+            transaction.set_rollback(True)
+
+    def run(self, name, engine, keystrokes, limit):
+        # Первый вызов прогревает массив в памяти и соединение
+        list(engine.search(keystrokes[0], limit))
+        timings = []
+        with CaptureQueriesContext(connection) as queries:
+            for query in keystrokes:
+                started = time.perf_counter()
+                list(engine.search(query, limit))
+                timings.append(time.perf_counter() - started)
+        summary = timing_summary(timings)
+        self.stdout.write(
+            f'{name}: {summary["count"]} keystrokes, '
+            f'p50 {summary["p50_ms"]} ms, p95 {summary["p95_ms"]} ms, '
+            f'max {summary["max_ms"]} ms, '
+            f'{len(queries) / len(keystrokes):.2f} queries/keystroke'
+        )
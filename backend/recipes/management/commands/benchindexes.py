@@ -0,0 +1,92 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count, Sum
+
+from recipes.models import (FavoriteRecipes, Recipe, RecipeIngredient,
+                            ShoppingCart)
+from ._private import timing_summary
+
+User = get_user_model()
+
+# Индекс из 0014/0015, без которого сравнивается запрос
+QUERY_INDEXES = {
+    "author feed": "recipe_author_idx",
+    "favorites of recipe": "favorite_recipe_user_idx",
+    "carts with recipe": "cart_recipe_user_idx",
+    "shopping list": "recipe_ingredient_cover_idx",
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Prints EXPLAIN and timings of the hot lookups on the current data; '
+        'on PostgreSQL also without each index of 0014/0015, dropped inside '
+        'a rolled back transaction (takes an exclusive lock on the table)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=200)
+        parser.add_argument(
+            '--no-compare', action='store_true',
+            help='Do not drop indexes for comparison'
+        )
+
+    def handle(self, *args, **options):
+        queries = self.queries()
+        for name, queryset in queries.items():
+            self.report(name, queryset, options["repeat"])
+        if options["no_compare"] or connection.vendor != "postgresql":
+            return
+        for name, index in QUERY_INDEXES.items():
+            with transaction.atomic():
+                with connection.cursor() as cursor:
+                    cursor.execute(f"DROP INDEX IF EXISTS {index}")
+                self.report(
+                    f"{name} without {index}", queries[name],
+                    options["repeat"])
+                transaction.set_rollback(True)
+
+    def queries(self):
+        """Запросы API на самых нагруженных строках текущих данных"""
+        recipe = Recipe.objects.order_by("-favorites_count", "-id").first()
+        author = User.objects.order_by("-recipes_count", "-id").first()
+        user = (
+            User.objects.annotate(in_cart=Count("cart_user"))
+            .order_by("-in_cart", "-id").first()
+        )
+        if recipe is None or author is None:
+            raise CommandError('No recipes: run generatedata first')
+        return {
+            "favorite exists": FavoriteRecipes.objects.filter(
+                user=user, recipe=recipe),
+            "recipe page flags": Recipe.objects.with_user_flags(user)
+            .order_by("-id")[:6],
+            "author feed": Recipe.objects.filter(author=author)
+            .order_by("-id")[:6],
+            "favorites of recipe": FavoriteRecipes.objects.filter(
+                recipe=recipe).values_list("user_id", flat=True),
+            "carts with recipe": ShoppingCart.objects.filter(
+                recipe=recipe).values_list("user_id", flat=True),
+            "shopping list": RecipeIngredient.objects.filter(
+                recipe__carts_recipe__user=user)
+            .values_list("ingredient_id")
+            .annotate(amount=Sum("amount"))
+            .order_by("ingredient_id"),
+        }
+
+    def report(self, name, queryset, repeat):
+        analyze = connection.vendor == "postgresql"
+        self.stdout.write(f'== {name}')
+        self.stdout.write(
+            queryset.explain(analyze=True) if analyze else queryset.explain())
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            list(queryset.all())
+            timings.append(time.perf_counter() - started)
+        summary = timing_summary(timings)
+        self.stdout.write(
+            f'p50 {summary["p50_ms"]} ms p95 {summary["p95_ms"]} ms')
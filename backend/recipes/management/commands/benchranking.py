@@ -0,0 +1,105 @@
+import random
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from recipes.models import FavoriteRecipes, Recipe
+from recipes.ranking import refresh_trending
+from ._private import SyntheticDataset, batched, timing_summary
+
+
+class Command(BaseCommand):
+    help = (
+        'Times full and incremental trending refreshes and the trending '
+        'page query on synthetic favorites that are rolled back'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--favorites', type=int, default=10000000)
+        parser.add_argument('--recipes', type=int, default=50000)
+        parser.add_argument('--days', type=int, default=30)
+        parser.add_argument(
+            '--new-share', type=float, default=0.01,
+            help='Share of favorites added before the incremental refresh'
+        )
+        parser.add_argument('--batch-size', type=int, default=10000)
+        parser.add_argument('--repeat', type=int, default=10)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        random.seed(options["seed"])
+        now = timezone.now()
+        start = now - timedelta(days=options["days"])
+        settled = now - timedelta(hours=1)
+        # Пары (пользователь, рецепт) уникальны: k -> (k // R, k % R)
+        fresh = int(options["favorites"] * options["new_share"])
+        with transaction.atomic():
+            recipes, users = self.generate_owners(options)
+            self.generate(
+                recipes, users, range(options["favorites"] - fresh),
+                start, settled, options["batch_size"],
+            )
+            self.timed("full refresh", lambda: refresh_trending(
+                full=True, until=settled,
+                batch_size=options["batch_size"]))
+            self.generate(
+                recipes, users,
+                range(options["favorites"] - fresh, options["favorites"]),
+                settled, now, options["batch_size"],
+            )
+            self.timed("incremental refresh", lambda: refresh_trending(
+                until=now, batch_size=options["batch_size"]))
+            self.measure(options["repeat"])
+            transaction.set_rollback(True)
+
+    def generate_owners(self, options):
+        # Состав и теги на пересчёт не влияют: рецепты без них
+        dataset = SyntheticDataset(
+            "bench_ranking", options["seed"], options["batch_size"],
+            options["days"])
+        dataset.make_image()
+        users = dataset.make_users(
+            -(-options["favorites"] // options["recipes"]))
+        recipes = dataset.make_recipes(users[:1], options["recipes"])
+        return [recipe.pk for recipe in recipes], [user.pk for user in users]
+
+    def generate(self, recipes, users, keys, start, end, batch_size):
+        started = time.monotonic()
+        span = (end - start).total_seconds()
+        for batch in batched(keys, batch_size):
+            FavoriteRecipes.objects.bulk_create(
+                FavoriteRecipes(
+                    user_id=users[key // len(recipes)],
+                    recipe_id=recipes[key % len(recipes)],
+                    created_at=start + timedelta(
+                        seconds=random.random() * span),
+                )
+                for key in batch
+            )
+        self.stdout.write(
+            f'Generated {len(keys)} favorites '
+            f'in {time.monotonic() - started:.1f}s')
+
+    def timed(self, name, refresh):
+        started = time.monotonic()
+        result = refresh()
+        self.stdout.write(
+            f'{name}: {result.events} events '
+            f'in {time.monotonic() - started:.1f}s')
+
+    def measure(self, repeat):
+        queryset = Recipe.objects.order_by(
+            F("ranking__trending").desc(nulls_last=True), "-id")
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            list(queryset[:6])
+            timings.append(time.perf_counter() - started)
+        summary = timing_summary(timings)
+        self.stdout.write(
+            f'trending page: p50 {summary["p50_ms"]} ms '
+            f'p95 {summary["p95_ms"]} ms')
@@ -0,0 +1,80 @@
+import time
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory
+
+from api.renderers import FastJSONRenderer, orjson
+from api.serializers import RecipeReadSerializer
+from recipes.models import Recipe
+from ._private import INGREDIENTS_PER_RECIPE, SyntheticDataset, timing_summary
+
+
+class Command(BaseCommand):
+    help = (
+        'Compares JSONRenderer and FastJSONRenderer on recipe pages '
+        'serialized from synthetic data that is rolled back'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--pages', type=int, nargs='+', default=[6, 50, 200])
+        parser.add_argument(
+            '--ingredients-per-recipe', type=int, nargs=2,
+            default=INGREDIENTS_PER_RECIPE, metavar=('MIN', 'MAX'))
+        parser.add_argument(
+            '--file', default='data/ingredients.csv',
+            help='Ingredients csv-file used when the table is empty'
+        )
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--repeat', type=int, default=200)
+
+    def handle(self, *args, **options):
+        if orjson is None:
+            self.stdout.write('orjson is not installed: fallback only')
+        with transaction.atomic():
+            results = self.serialize(max(options["pages"]), options)
+            transaction.set_rollback(True)
+        for size in options["pages"]:
+            page = {
+                "count": len(results), "next": None, "previous": None,
+                "results": results[:size],
+            }
+            self.measure(size, page, options["repeat"])
+
+    def serialize(self, count, options):
+        dataset = SyntheticDataset("bench_render", options["seed"])
+        dataset.load_ingredients(options["file"])
+        dataset.make_image()
+        authors = dataset.make_users(1)
+        dataset.make_recipes(
+            authors, count, dataset.make_tags(3),
+            options["ingredients_per_recipe"])
+        request = APIRequestFactory().get("/api/recipes/")
+        request.user = AnonymousUser()
+        context = {"request": request}
+        return [
+            RecipeReadSerializer(recipe, context=context).data
+            for recipe in Recipe.objects.filter(author__in=authors)
+            .with_related().with_user_flags(None)
+        ]
+
+    def measure(self, size, page, repeat):
+        outputs = {}
+        for renderer in (JSONRenderer(), FastJSONRenderer()):
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                output = renderer.render(page)
+                timings.append(time.perf_counter() - started)
+            outputs[type(renderer).__name__] = output
+            summary = timing_summary(timings)
+            self.stdout.write(
+                f'{size} recipes, {type(renderer).__name__}: '
+                f'p50 {summary["p50_ms"]} ms p95 {summary["p95_ms"]} ms, '
+                f'{len(output)} bytes'
+            )
+        if len(set(outputs.values())) != 1:
+            raise CommandError(f'Output differs for {size} recipes')
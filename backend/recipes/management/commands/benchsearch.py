@@ -0,0 +1,83 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Q
+
+from recipes.models import Recipe
+from ._private import INGREDIENTS_PER_RECIPE, SyntheticDataset, timing_summary
+
+QUERIES = (
+    "суп", "салат с курицей", "пирог яблоки", "картофель", "сыр",
+    "шоколад", "запеканка творог", "острый соус", "борщ", "молоко",
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmarks recipe full-text search on a synthetic catalogue. '
+        'Everything it creates is rolled back'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipes', type=int, default=100000)
+        parser.add_argument(
+            '--ingredients-per-recipe', type=int, nargs=2,
+            default=INGREDIENTS_PER_RECIPE, metavar=('MIN', 'MAX'))
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument(
+            '--file', default='data/ingredients.csv',
+            help='Ingredients csv-file used when the table is empty'
+        )
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.generate(options)
+            self.measure(options["repeat"])
+            transaction.set_rollback(True)
+
+    def generate(self, options):
+        dataset = SyntheticDataset(
+            "bench_search", options["seed"], options["batch_size"])
+        dataset.load_ingredients(options["file"])
+        dataset.make_image()
+        authors = dataset.make_users(1)
+
+        started = time.monotonic()
+        dataset.make_recipes(
+            authors, options["recipes"],
+            ingredients_range=options["ingredients_per_recipe"])
+        self.stdout.write(
+            f'Generated {options["recipes"]} recipes '
+            f'in {time.monotonic() - started:.1f}s')
+
+        started = time.monotonic()
+        Recipe.objects.filter(author__in=authors).update_search_vector()
+        self.stdout.write(
+            f'search_vector filled in {time.monotonic() - started:.1f}s')
+
+    def measure(self, repeat):
+        methods = {
+            "search": lambda query: Recipe.objects.search(query),
+            "icontains": lambda query: Recipe.objects.filter(
+                Q(name__icontains=query) | Q(text__icontains=query)),
+        }
+        for name, method in methods.items():
+            timings = []
+            for _ in range(repeat):
+                for query in QUERIES:
+                    started = time.perf_counter()
+                    list(method(query)[:6])
+                    timings.append(time.perf_counter() - started)
+            summary = timing_summary(timings)
+            self.stdout.write(
+                f'{name}: {summary["count"]} queries, '
+                f'p50 {summary["p50_ms"]} ms, p95 {summary["p95_ms"]} ms, '
+                f'max {summary["max_ms"]} ms'
+            )
+        if connection.vendor == "postgresql":
+            plan = Recipe.objects.search(QUERIES[0])[:6].explain(
+                analyze=True)
+            self.stdout.write(plan)
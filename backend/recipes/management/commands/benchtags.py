@@ -0,0 +1,75 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Exists, OuterRef
+
+from recipes.models import Recipe, RecipeTag
+from ._private import SyntheticDataset, timing_summary
+
+
+class Command(BaseCommand):
+    help = (
+        'Compares multi-tag recipe filtering (JOIN + DISTINCT against '
+        'EXISTS / IN on RecipeTag) on synthetic data that is rolled back'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipes', type=int, default=200000)
+        parser.add_argument('--tags', type=int, default=12)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--repeat', type=int, default=10)
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--explain', action='store_true')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            slugs = self.generate(options)
+            self.measure(slugs[:3], options["repeat"], options["explain"])
+            transaction.set_rollback(True)
+
+    def generate(self, options):
+        # Состав в фильтре по тегам не участвует: рецепты без ингредиентов
+        dataset = SyntheticDataset(
+            "bench_tags", options["seed"], options["batch_size"])
+        dataset.make_image()
+        authors = dataset.make_users(1)
+        tags = dataset.make_tags(options["tags"])
+        started = time.monotonic()
+        dataset.make_recipes(authors, options["recipes"], tags)
+        self.stdout.write(
+            f'Generated {options["recipes"]} recipes '
+            f'in {time.monotonic() - started:.1f}s')
+        return [tag.slug for tag in tags]
+
+    def measure(self, slugs, repeat, explain):
+        recipe_tags = RecipeTag.objects.filter(tag__slug__in=slugs)
+        variants = {
+            "join + distinct (any)": Recipe.objects.filter(
+                tags__slug__in=slugs).distinct(),
+            "exists (any)": Recipe.objects.filter(
+                Exists(recipe_tags.filter(recipe=OuterRef("pk")))),
+            "in + having (all)": Recipe.objects.filter(
+                id__in=recipe_tags.values("recipe")
+                .annotate(matched=Count("id"))
+                .filter(matched=len(slugs))
+                .values("recipe")
+            ),
+        }
+        for name, queryset in variants.items():
+            page, total = [], []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                list(queryset[:6])
+                page.append(time.perf_counter() - started)
+                started = time.perf_counter()
+                queryset.count()
+                total.append(time.perf_counter() - started)
+            page, total = timing_summary(page), timing_summary(total)
+            self.stdout.write(
+                f'{name}: page p50 {page["p50_ms"]} ms '
+                f'p95 {page["p95_ms"]} ms, count p50 {total["p50_ms"]} ms '
+                f'p95 {total["p95_ms"]} ms'
+            )
+            if explain:
+                self.stdout.write(queryset[:6].explain())
@@ -0,0 +1,95 @@
+import posixpath
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from recipes.images import RENDITIONS, RENDITIONS_DIR
+from recipes.models import MediaFile, Recipe
+from recipes.storage import image_storage
+from ._private import batched
+
+
+class Command(BaseCommand):
+    help = (
+        'Removes recipe images (and their renditions) that no recipe '
+        'references any more'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument(
+            '--grace-hours', type=int, default=24,
+            help='Keep files released or written less than this ago'
+        )
+        parser.add_argument(
+            '--scan', action='store_true',
+            help='Also remove untracked files found in the media directory'
+        )
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        self.dry_run = options["dry_run"]
+        cutoff = timezone.now() - timedelta(hours=options["grace_hours"])
+        removed = self.collect_released(cutoff, options["batch_size"])
+        if options["scan"]:
+            removed += self.collect_untracked(cutoff, options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(
+            f'{"Would remove" if self.dry_run else "Removed"} '
+            f'{removed} files'))
+
+    def collect_released(self, cutoff, batch_size):
+        removed = 0
+        last_id = 0
+        while True:
+            batch = list(
+                MediaFile.objects.filter(
+                    id__gt=last_id, references__lte=0, updated_at__lt=cutoff)
+                .order_by("id")[:batch_size]
+            )
+            if not batch:
+                return removed
+            last_id = batch[-1].id
+            names = self.unreferenced([media.name for media in batch])
+            self.delete_files(names)
+            if not self.dry_run:
+                MediaFile.objects.filter(
+                    name__in=names, references__lte=0).delete()
+            removed += len(names)
+
+    def collect_untracked(self, cutoff, batch_size):
+        directory = posixpath.dirname(Recipe._meta.get_field(
+            "image").upload_to.rstrip("/") + "/")
+        _, files = image_storage.listdir(directory)
+        removed = 0
+        for batch in batched(files, batch_size):
+            names = [posixpath.join(directory, name) for name in batch]
+            tracked = set(MediaFile.objects.filter(
+                name__in=names).values_list("name", flat=True))
+            names = [
+                name for name in self.unreferenced(names)
+                if name not in tracked
+                and image_storage.get_modified_time(name) < cutoff
+            ]
+            self.delete_files(names)
+            removed += len(names)
+        return removed
+
+    def unreferenced(self, names):
+        referenced = set(Recipe.objects.filter(
+            image__in=names).values_list("image", flat=True))
+        return [name for name in names if name not in referenced]
+
+    def delete_files(self, names):
+        for name in names:
+            stem = posixpath.splitext(posixpath.basename(name))[0]
+            paths = [name] + [
+                f"{RENDITIONS_DIR}/{stem}_{size_name}.{extension}"
+                for size_name in RENDITIONS
+                for extension in ("webp", "jpg")
+            ]
+            for path in paths:
+                if image_storage.exists(path):
+                    self.stdout.write(f'- {path}')
+                    if not self.dry_run:
+                        image_storage.delete(path)
@@ -0,0 +1,98 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from recipes.checks import cache_is_shared
+from recipes.models import (FavoriteRecipes, Ingredient, Recipe, ShoppingCart,
+                            Tag)
+from recipes.utils import bump_cache_version
+from users.models import Follow
+from ._private import INGREDIENTS_PER_RECIPE, SyntheticDataset
+
+User = get_user_model()
+
+PREFIX = "synthetic"
+
+
+class Command(BaseCommand):
+    help = (
+        'Generates a reproducible synthetic dataset: users, recipes, '
+        'tags, follows, favorites and shopping carts'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument(
+            '--authors', type=float, default=0.2,
+            help='Share of users that publish recipes'
+        )
+        parser.add_argument('--recipes-per-author', type=int, default=10)
+        parser.add_argument(
+            '--ingredients-per-recipe', type=int, nargs=2,
+            default=INGREDIENTS_PER_RECIPE,
+            metavar=('MIN', 'MAX'))
+        parser.add_argument('--tags', type=int, default=6)
+        parser.add_argument('--follows-per-user', type=int, default=10)
+        parser.add_argument('--favorites-per-user', type=int, default=20)
+        parser.add_argument('--carts-per-user', type=int, default=5)
+        parser.add_argument('--days', type=int, default=30)
+        parser.add_argument(
+            '--ingredients-file', default='data/ingredients.csv',
+            help='Loaded with importcsv when there are no ingredients yet'
+        )
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument(
+            '--clear', action='store_true',
+            help='Remove a previously generated dataset first'
+        )
+
+    def handle(self, *args, **options):
+        dataset = SyntheticDataset(
+            PREFIX, options["seed"], options["batch_size"], options["days"])
+        started = time.monotonic()
+        if options["clear"]:
+            self.clear()
+        elif User.objects.filter(username__startswith=f"{PREFIX}_").exists():
+            raise CommandError('Synthetic data already exists, use --clear')
+        if not Ingredient.objects.exists():
+            call_command("importcsv", options["ingredients_file"],
+                         "Ingredient", stdout=self.stdout)
+        dataset.make_image()
+        with transaction.atomic():
+            users = dataset.make_users(options["users"])
+            authors = users[:max(1, int(len(users) * options["authors"]))]
+            tags = dataset.make_tags(options["tags"])
+            recipes = dataset.make_recipes(
+                authors, options["recipes_per_author"], tags,
+                options["ingredients_per_recipe"])
+            dataset.make_links(
+                Follow, "author", users, authors,
+                options["follows_per_user"])
+            dataset.make_links(
+                FavoriteRecipes, "recipe", users, recipes,
+                options["favorites_per_user"])
+            dataset.make_links(
+                ShoppingCart, "recipe", users, recipes,
+                options["carts_per_user"])
+        # bulk_create не посылает сигналов: пересчитываем зависимое сами
+        call_command("reconcilecounters", stdout=self.stdout)
+        Recipe.objects.filter(
+            author__username__startswith=f"{PREFIX}_").update_search_vector()
+        for model in (Tag, Ingredient):
+            bump_cache_version(model._meta.label)
+        if not cache_is_shared():
+            self.stdout.write(self.style.WARNING(
+                'Cache is local to this process: restart the web server '
+                'to drop cached tags and ingredients'))
+        self.stdout.write(self.style.SUCCESS(
+            f'Generated {len(users)} users and {len(recipes)} recipes '
+            f'in {time.monotonic() - started:.1f}s'))
+
+    def clear(self):
+        with transaction.atomic():
+            User.objects.filter(username__startswith=f"{PREFIX}_").delete()
+            Tag.objects.filter(slug__startswith=f"{PREFIX}-").delete()
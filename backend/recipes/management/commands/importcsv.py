@@ -1,31 +1,141 @@
 import csv
+import io
+import time
 
 from django.apps import apps
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from recipes.checks import cache_is_shared
+from recipes.utils import bump_cache_version
+from ._private import FILE_FORMATS, batched, detect_format, read_rows
 
 
 class Command(BaseCommand):
-    help = 'Imports data from csv-file'
+    help = (
+        'Imports data from csv or json file. Rows already present in the '
+        'table (all imported columns equal) are skipped, the whole file '
+        'is loaded in a single transaction'
+    )
 
     def add_arguments(self, parser):
         parser.add_argument('file_path', type=str, help='Define file path')
         parser.add_argument('model', type=str, help='Define model')
+        parser.add_argument(
+            '--format', choices=FILE_FORMATS, dest='file_format',
+            help='File format, detected by extension by default'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Rows per INSERT statement'
+        )
+        parser.add_argument(
+            '--method', choices=('auto', 'bulk', 'copy'), default='auto',
+            help='copy uses COPY FROM STDIN (PostgreSQL only), '
+                 'auto picks it when available'
+        )
+        parser.add_argument('--delimiter', default=',')
 
     def handle(self, *args, **options):
         file_path = options["file_path"]
         model_cl = apps.get_model('recipes', options["model"])
+        file_format = options["file_format"] or detect_format(file_path)
+        header, rows = read_rows(
+            file_path, file_format, options["delimiter"])
+        columns = self.get_columns(model_cl, header)
 
-        with open(file_path, "r", encoding="utf-8") as csv_file:
-            reader = csv.reader(csv_file, delimiter=',')
-            header = next(reader)
-            for row in reader:
-                obj_dict = {key: value for key, value in zip(header, row)}
+        method = options["method"]
+        if method == "auto":
+            method = "copy" if connection.vendor == "postgresql" else "bulk"
+        if method == "copy" and connection.vendor != "postgresql":
+            raise CommandError("COPY is available only on PostgreSQL")
 
-                print(obj_dict)
-                model_cl.objects.create(**obj_dict)
+        started = time.monotonic()
+        with transaction.atomic():
+            if method == "copy":
+                read, created = self.copy_rows(
+                    model_cl, columns, rows, options["batch_size"], started)
+            else:
+                read, created = self.bulk_create_rows(
+                    model_cl, header, rows, options["batch_size"], started)
+        # bulk_create и COPY не посылают сигналов, кеши сбрасываем сами
+        bump_cache_version(model_cl._meta.label)
+        elapsed = time.monotonic() - started
+        if not cache_is_shared():
+            self.stdout.write(self.style.WARNING(
+                'Cache is local to this process: restart the web server '
+                'to drop cached tags and ingredients'))
 
         self.stdout.write(
             self.style.SUCCESS(
-                'File successfully imported'
+                f'File successfully imported: {read} rows read, '
+                f'{created} created, {read - created} skipped as duplicates '
+                f'in {elapsed:.2f}s ({read / max(elapsed, 1e-6):.0f} rows/s)'
             )
         )
+
+    def get_columns(self, model_cl, header):
+        fields = {
+            field.name: field for field in model_cl._meta.concrete_fields}
+        unknown = [name for name in header if name not in fields]
+        if not header or unknown:
+            raise CommandError(
+                f'Unknown columns for {model_cl.__name__}: {unknown}')
+        return [fields[name].column for name in header]
+
+    def report(self, started, read, created=None):
+        elapsed = time.monotonic() - started
+        created = '' if created is None else f', {created} created'
+        self.stdout.write(
+            f'{read} rows read{created} '
+            f'({read / max(elapsed, 1e-6):.0f} rows/s)'
+        )
+
+    def bulk_create_rows(self, model_cl, header, rows, batch_size, started):
+        seen = set(model_cl.objects.values_list(*header))
+        read = created = 0
+        for batch in batched(rows, batch_size):
+            read += len(batch)
+            objects = []
+            for row in batch:
+                if row in seen:
+                    continue
+                seen.add(row)
+                objects.append(model_cl(**dict(zip(header, row))))
+            model_cl.objects.bulk_create(objects, batch_size=batch_size)
+            created += len(objects)
+            self.report(started, read, created)
+        return read, created
+
+    def copy_rows(self, model_cl, columns, rows, batch_size, started):
+        """COPY во временную таблицу и перенос только новых строк"""
+        table = connection.ops.quote_name(model_cl._meta.db_table)
+        quoted = ", ".join(connection.ops.quote_name(c) for c in columns)
+        match = " AND ".join(
+            f"target.{name} = staging.{name}"
+            for name in (connection.ops.quote_name(c) for c in columns)
+        )
+        read = 0
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE TEMPORARY TABLE import_staging ON COMMIT DROP "
+                f"AS SELECT {quoted} FROM {table} WITH NO DATA"
+            )
+            for batch in batched(rows, batch_size):
+                buffer = io.StringIO()
+                csv.writer(buffer).writerows(batch)
+                buffer.seek(0)
+                cursor.copy_expert(
+                    f"COPY import_staging ({quoted}) FROM STDIN WITH CSV",
+                    buffer,
+                )
+                read += len(batch)
+                self.report(started, read)
+            cursor.execute(
+                f"INSERT INTO {table} ({quoted}) "
+                f"SELECT DISTINCT {quoted} FROM import_staging staging "
+                f"WHERE NOT EXISTS (SELECT 1 FROM {table} target "
+                f"WHERE {match})"
+            )
+            created = cursor.rowcount
+        return read, created
@@ -0,0 +1,60 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from recipes.models import FavoriteRecipes, Recipe, ShoppingCart
+from recipes.utils import actual_count
+from users.models import Follow
+
+User = get_user_model()
+
+# (модель со счётчиком, поле счётчика, считаемая модель, её внешний ключ)
+COUNTERS = (
+    (Recipe, "favorites_count", FavoriteRecipes, "recipe"),
+    (Recipe, "in_carts_count", ShoppingCart, "recipe"),
+    (User, "recipes_count", Recipe, "author"),
+    (User, "followers_count", Follow, "author"),
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Recounts denormalized favorites, carts, recipes and followers '
+        'counters and fixes the rows that drifted'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        for model, counter, related_model, field in COUNTERS:
+            fixed = self.reconcile(
+                model, counter, actual_count(related_model, field),
+                options["batch_size"], options["dry_run"],
+            )
+            self.stdout.write(
+                f'{model._meta.model_name}.{counter}: {fixed} rows drifted')
+
+    def reconcile(self, model, counter, actual, batch_size, dry_run):
+        """Проходит таблицу диапазонами id, в каждом - один UPDATE"""
+        fixed = 0
+        last_id = 0
+        while True:
+            ids = list(
+                model.objects.filter(id__gt=last_id)
+                .order_by("id")
+                .values_list("id", flat=True)[:batch_size]
+            )
+            if not ids:
+                return fixed
+            drifted = (
+                model.objects.filter(id__gt=last_id, id__lte=ids[-1])
+                .annotate(actual=actual)
+                .exclude(**{counter: actual})
+            )
+            if dry_run:
+                fixed += drifted.count()
+            else:
+                fixed += model.objects.filter(
+                    id__in=drifted.values("id")).update(**{counter: actual})
+            last_id = ids[-1]
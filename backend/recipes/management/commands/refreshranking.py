@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from recipes.ranking import refresh_trending
+
+
+class Command(BaseCommand):
+    help = (
+        'Adds favorites and shopping cart activity since the previous run '
+        'to the trending ranking (run it from cron every few minutes)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full', action='store_true',
+            help='Rebuild the ranking from scratch'
+        )
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        refresh = refresh_trending(
+            full=options["full"], batch_size=options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(
+            f'{"Rebuilt" if refresh.full else "Refreshed"} ranking with '
+            f'{refresh.events} events in {time.monotonic() - started:.1f}s'))
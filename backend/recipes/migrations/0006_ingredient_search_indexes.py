@@ -0,0 +1,37 @@
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+INDEXES = (
+    "CREATE INDEX IF NOT EXISTS recipes_ingredient_name_prefix_idx "
+    "ON recipes_ingredient (lower(name) varchar_pattern_ops)",
+    "CREATE INDEX IF NOT EXISTS recipes_ingredient_name_trgm_idx "
+    "ON recipes_ingredient USING gin (lower(name) gin_trgm_ops)",
+)
+
+
+def create_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for sql in INDEXES:
+        schema_editor.execute(sql)
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute(
+        "DROP INDEX IF EXISTS recipes_ingredient_name_prefix_idx, "
+        "recipes_ingredient_name_trgm_idx"
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0005_alter_ingredient_measurement_unit_and_more'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.0.6 on 2026-10-18 19:45
+
+from django.db import migrations, models
+
+
+def drop_raw_index(apps, schema_editor):
+    # 0014 создавал индекс SQL-запросом мимо состояния моделей,
+    # дальше им управляет Meta.indexes
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute("DROP INDEX IF EXISTS recipe_ingredient_cover_idx")
+
+
+def create_raw_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute(
+        "CREATE INDEX IF NOT EXISTS recipe_ingredient_cover_idx "
+        "ON recipes_recipeingredient (recipe_id, ingredient_id) "
+        "INCLUDE (amount)"
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0014_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_raw_index, create_raw_index),
+        migrations.AddIndex(
+            model_name='recipeingredient',
+            index=models.Index(fields=['recipe', 'ingredient'], include=('amount',), name='recipe_ingredient_cover_idx'),
+        ),
+    ]
@@ -1,7 +1,18 @@
 from colorfield.fields import ColorField
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            SearchVector, SearchVectorField)
 from django.core.validators import MinValueValidator
-from django.db import models
+from django.db import connection, models
+from django.db.models import (Exists, F, OuterRef, Prefetch, Q, Subquery,
+                              Value, Window)
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import RowNumber
+from django.utils import timezone
+
+from .storage import get_image_storage
 
 User = get_user_model()
 
@@ -36,18 +47,137 @@ class Ingredient(models.Model):
         return f"{self.name}"
 
 
+def recipe_prefetches():
+    """Ингредиенты и теги рецептов: по одному запросу на страницу"""
+    return (
+        Prefetch(
+            "recipe_with_ingredients",
+            queryset=RecipeIngredient.objects.select_related("ingredient"),
+        ),
+        Prefetch(
+            "tag_recipe",
+            queryset=RecipeTag.objects.select_related("tag"),
+        ),
+    )
+
+
+class RecipeQuerySet(models.QuerySet):
+    def with_related(self):
+        """Автор, ингредиенты и теги одним фиксированным набором запросов"""
+        return self.select_related("author").prefetch_related(
+            *recipe_prefetches())
+
+    def with_user_flags(self, user):
+        """Флаги is_favorited / is_in_shopping_cart для пользователя"""
+        if user is None or user.is_anonymous:
+            return self.annotate(
+                is_favorited=Value(False, output_field=models.BooleanField()),
+                is_in_shopping_cart=Value(
+                    False, output_field=models.BooleanField()),
+            )
+        return self.annotate(
+            is_favorited=Exists(
+                FavoriteRecipes.objects.filter(
+                    user=user, recipe=OuterRef("pk"))
+            ),
+            is_in_shopping_cart=Exists(
+                ShoppingCart.objects.filter(user=user, recipe=OuterRef("pk"))
+            ),
+        )
+
+    def latest_per_author(self, limit):
+        """Не больше limit последних рецептов каждого автора.
+
+        Номер рецепта внутри автора считается через
+        ROW_NUMBER() OVER (PARTITION BY author), поэтому ограничение
+        применяется одним запросом сразу для всех авторов.
+        """
+        ranked = (
+            self.order_by()
+            .annotate(
+                author_position=Window(
+                    expression=RowNumber(),
+                    partition_by=[F("author")],
+                    order_by=F("id").desc(),
+                )
+            )
+            .values("id", "author_position")
+        )
+        sql, params = ranked.query.sql_with_params()
+        return self.model.objects.filter(
+            id__in=RawSQL(
+                f"SELECT ranked.id FROM ({sql}) ranked "
+                "WHERE ranked.author_position <= %s",
+                (*params, limit),
+            )
+        )
+
+    def touch(self):
+        """Сдвигает updated_at, когда ответ меняется без save() рецепта"""
+        return self.update(updated_at=timezone.now())
+
+    def update_search_vector(self):
+        """Пересчитывает search_vector: название, ингредиенты, описание"""
+        if connection.vendor != "postgresql":
+            return 0
+        config = settings.RECIPE_SEARCH_CONFIG
+        ingredient_names = Subquery(
+            RecipeIngredient.objects.filter(recipe=OuterRef("pk"))
+            .values("recipe")
+            .annotate(names=StringAgg("ingredient__name", delimiter=" "))
+            .values("names")
+        )
+        return self.update(
+            search_vector=(
+                SearchVector("name", weight="A", config=config)
+                + SearchVector(ingredient_names, weight="B", config=config)
+                + SearchVector("text", weight="C", config=config)
+            )
+        )
+
+    def search(self, query):
+        """Полнотекстовый поиск с сортировкой по релевантности.
+
+        Вне PostgreSQL остаётся простой поиск по вхождению подстроки.
+        """
+        if connection.vendor != "postgresql":
+            return self.filter(
+                Q(name__icontains=query)
+                | Q(text__icontains=query)
+                | Exists(
+                    RecipeIngredient.objects.filter(
+                        recipe=OuterRef("pk"),
+                        ingredient__name__icontains=query,
+                    )
+                )
+            )
+        search_query = SearchQuery(
+            query,
+            config=settings.RECIPE_SEARCH_CONFIG,
+            search_type="websearch",
+        )
+        return (
+            self.filter(search_vector=search_query)
+            .annotate(rank=SearchRank(F("search_vector"), search_query))
+            .order_by("-rank", "-id")
+        )
+
+
 class Recipe(models.Model):
     """Рецепты"""
 
+    # Столбец author_id ведущий в recipe_author_idx
     author = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
         related_name="recipe_author",
         verbose_name="Автор",
+        db_index=False,
     )
     name = models.CharField(max_length=50, null=False,
                             verbose_name="Название рецепта")
-    image = models.ImageField(upload_to="media/")
+    image = models.ImageField(upload_to="media/", storage=get_image_storage)
+    renditions = models.JSONField(default=dict, blank=True, editable=False)
     ingredients = models.ManyToManyField(
         Ingredient, related_name="ingredients", through="RecipeIngredient"
     )
@@ -64,11 +194,28 @@ class Recipe(models.Model):
                 1, "Значение не может быть меньше 1")
         ]
     )
+    search_vector = SearchVectorField(null=True, editable=False)
+    favorites_count = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name="В избранном")
+    in_carts_count = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name="В списках покупок")
+    created_at = models.DateTimeField(
+        default=timezone.now, db_index=True, editable=False,
+        verbose_name="Создан")
+    updated_at = models.DateTimeField(
+        auto_now=True, db_index=True, verbose_name="Изменён")
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
         verbose_name = "Рецепт"
         verbose_name_plural = "Рецепты"
         ordering = ["-id"]
+        indexes = [
+            models.Index(
+                fields=["-favorites_count", "-id"], name="recipe_popular_idx"),
+            models.Index(fields=["author", "-id"], name="recipe_author_idx"),
+        ]
 
     def __str__(self):
         return self.name
@@ -86,14 +233,18 @@ class RecipeTag(models.Model):
             models.UniqueConstraint(
                 fields=["recipe", "tag"], name="unique recipe tag")
         ]
+        indexes = [
+            models.Index(fields=["tag", "recipe"], name="recipe_tag_tag_idx")
+        ]
         verbose_name = "Теги рецепта"
         verbose_name_plural = "Теги рецептов"
 
 
 class RecipeIngredient(models.Model):
+    # recipe_id ведущий в unique recipe ingredient
     recipe = models.ForeignKey(
         Recipe, on_delete=models.CASCADE,
-        related_name="recipe_with_ingredients"
+        related_name="recipe_with_ingredients", db_index=False,
     )
     ingredient = models.ForeignKey(
         Ingredient, on_delete=models.CASCADE,
@@ -112,6 +263,14 @@ class RecipeIngredient(models.Model):
                 name="unique recipe ingredient"
             )
         ]
+        indexes = [
+            # Состав рецепта и список покупок читают amount из индекса.
+            # Без поддержки INCLUDE (SQLite) amount в индекс не входит
+            models.Index(
+                fields=["recipe", "ingredient"], include=["amount"],
+                name="recipe_ingredient_cover_idx",
+            )
+        ]
         verbose_name = "Ингредиенты рецепта"
         verbose_name_plural = "Ингредиенты рецептов"
 
@@ -120,24 +279,34 @@ class RecipeIngredient(models.Model):
 
 
 class FavoriteRecipes(models.Model):
+    # Отдельные индексы по user_id и recipe_id не нужны: это ведущие
+    # столбцы уникального ограничения и индекса favorite_recipe_user_idx
     user = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
         related_name="favorites_user",
         verbose_name="Пользователь",
+        db_index=False,
     )
     recipe = models.ForeignKey(
         Recipe,
         on_delete=models.CASCADE,
         related_name="favorites_recipe",
         verbose_name="Рецепт",
+        db_index=False,
     )
+    created_at = models.DateTimeField(
+        default=timezone.now, db_index=True, verbose_name="Добавлен")
 
     class Meta:
         constraints = [
             models.UniqueConstraint(
                 fields=["user", "recipe"], name="unique favorite")
         ]
+        indexes = [
+            models.Index(
+                fields=["recipe", "user"], name="favorite_recipe_user_idx")
+        ]
         verbose_name = "Избранный рецепт"
         verbose_name_plural = "Избранные рецепты"
 
@@ -146,18 +315,24 @@ class FavoriteRecipes(models.Model):
 
 
 class ShoppingCart(models.Model):
+    # Отдельные индексы по user_id и recipe_id не нужны: это ведущие
+    # столбцы уникального ограничения и индекса cart_recipe_user_idx
     user = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
         related_name="cart_user",
         verbose_name="Пользователь",
+        db_index=False,
     )
     recipe = models.ForeignKey(
         Recipe,
         on_delete=models.CASCADE,
         related_name="carts_recipe",
         verbose_name="Рецепт",
+        db_index=False,
     )
+    created_at = models.DateTimeField(
+        default=timezone.now, db_index=True, verbose_name="Добавлен")
 
     class Meta:
         constraints = [
@@ -166,8 +341,63 @@ class ShoppingCart(models.Model):
                 name="unique user recipe shoppingcart"
             )
         ]
+        indexes = [
+            models.Index(
+                fields=["recipe", "user"], name="cart_recipe_user_idx")
+        ]
         verbose_name = "Список покупок"
         verbose_name_plural = "Списки покупок"
 
     def __str__(self):
         return self.recipe.name
+
+
+class MediaFile(models.Model):
+    """Счётчик ссылок рецептов на файл картинки"""
+
+    name = models.CharField(max_length=255, unique=True)
+    references = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        verbose_name = "Файл картинки"
+        verbose_name_plural = "Файлы картинок"
+
+    def __str__(self):
+        return self.name
+
+
+class RecipeRanking(models.Model):
+    """Рейтинг trending, пересчитывается командой refreshranking.
+
+    Хранится логарифм суммы весов событий, приведённых к общей эпохе
+    (forward decay): порядок строк тот же, что у затухающей суммы,
+    но старые строки не нужно пересчитывать при каждом обновлении.
+    """
+
+    recipe = models.OneToOneField(
+        Recipe, on_delete=models.CASCADE, primary_key=True,
+        related_name="ranking",
+    )
+    trending = models.FloatField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["-trending"], name="recipe_trending_idx")
+        ]
+        verbose_name = "Рейтинг рецепта"
+        verbose_name_plural = "Рейтинги рецептов"
+
+
+class RankingRefresh(models.Model):
+    """Журнал пересчётов: события до events_until уже учтены"""
+
+    events_until = models.DateTimeField()
+    events = models.PositiveIntegerField(default=0)
+    full = models.BooleanField(default=False)
+    finished_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Пересчёт рейтинга"
+        verbose_name_plural = "Пересчёты рейтинга"
@@ -0,0 +1,100 @@
+import math
+from datetime import datetime, timedelta
+from datetime import timezone as dt_timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import (FavoriteRecipes, RankingRefresh, Recipe, RecipeRanking,
+                     ShoppingCart)
+
+# Точка отсчёта forward decay: менять только вместе с полным пересчётом
+EPOCH = datetime(2022, 1, 1, tzinfo=dt_timezone.utc)
+# При полном пересчёте более старые события на порядок уже не влияют
+FULL_REFRESH_HALF_LIVES = 10
+# Последние секунды пропускаем: их транзакции могут быть не закоммичены
+SETTLE_DELAY = timedelta(seconds=30)
+
+
+def half_life():
+    return timedelta(hours=settings.RECIPE_TRENDING_HALF_LIFE_HOURS)
+
+
+def event_sources():
+    return (
+        (FavoriteRecipes, 1.0),
+        (ShoppingCart, settings.RECIPE_TRENDING_CART_WEIGHT),
+    )
+
+
+def logaddexp(first, second):
+    """log(e^first + e^second) без переполнения"""
+    if first is None:
+        return second
+    high, low = max(first, second), min(first, second)
+    return high + math.log1p(math.exp(low - high))
+
+
+def collect_events(since, until, chunk_size):
+    """Логарифмы вкладов событий из (since, until], сложенные по рецептам"""
+    rate = math.log(2) / half_life().total_seconds()
+    scores = {}
+    events = 0
+    for model, weight in event_sources():
+        if weight <= 0:
+            continue
+        log_weight = math.log(weight)
+        queryset = model.objects.filter(
+            created_at__gt=since, created_at__lte=until)
+        for recipe_id, created_at in queryset.values_list(
+            "recipe_id", "created_at"
+        ).iterator(chunk_size=chunk_size):
+            score = log_weight + rate * (created_at - EPOCH).total_seconds()
+            scores[recipe_id] = logaddexp(scores.get(recipe_id), score)
+            events += 1
+    return scores, events
+
+
+def apply_scores(scores, batch_size):
+    recipe_ids = list(scores)
+    now = timezone.now()
+    for start in range(0, len(recipe_ids), batch_size):
+        batch = recipe_ids[start:start + batch_size]
+        existing = RecipeRanking.objects.in_bulk(batch)
+        for recipe_id, ranking in existing.items():
+            ranking.trending = logaddexp(ranking.trending, scores[recipe_id])
+            ranking.updated_at = now
+        RecipeRanking.objects.bulk_update(
+            existing.values(), ["trending", "updated_at"])
+        # Рецепт могли удалить, пока шёл подсчёт
+        alive = Recipe.objects.filter(pk__in=[
+            recipe_id for recipe_id in batch if recipe_id not in existing
+        ]).values_list("pk", flat=True)
+        RecipeRanking.objects.bulk_create(
+            RecipeRanking(recipe_id=recipe_id, trending=scores[recipe_id])
+            for recipe_id in alive
+        )
+
+
+def refresh_trending(full=False, until=None, batch_size=5000):
+    """Добавляет в рейтинг события после прошлого пересчёта.
+
+    Убранные из избранного и списков покупок рецепты не вычитаются:
+    их вклад затухает сам, а точный рейтинг даёт полный пересчёт.
+    """
+    until = until or timezone.now() - SETTLE_DELAY
+    last = None if full else RankingRefresh.objects.order_by(
+        "-events_until").first()
+    if last is None:
+        since = until - half_life() * FULL_REFRESH_HALF_LIVES
+    else:
+        since = last.events_until
+    with transaction.atomic():
+        if last is None:
+            RecipeRanking.objects.all().delete()
+        scores, events = collect_events(since, until, batch_size)
+        apply_scores(scores, batch_size)
+        refresh = RankingRefresh.objects.create(
+            events_until=until, events=events, full=last is None)
+    return refresh
@@ -0,0 +1,110 @@
+from bisect import bisect_left
+
+from django.conf import settings
+from django.contrib.postgres.search import TrigramSimilarity
+from django.db import connection
+from django.db.models import Case, IntegerField, Value, When
+from django.db.models.functions import Lower
+
+from .models import Ingredient
+from .utils import get_cache_version
+
+INGREDIENTS_VERSION = Ingredient._meta.label
+# Короче этого поиск идёт только по началу названия:
+# по одной-двум буквам подстрока совпадает почти со всем списком.
+SUBSTRING_MIN_LENGTH = 3
+
+
+class PostgresIngredientSearch:
+    """Поиск по индексам lower(name) varchar_pattern_ops и gin_trgm_ops.
+
+    Сначала идут названия, начинающиеся с запроса, затем остальные
+    совпадения по подстроке в порядке триграммного сходства.
+    """
+
+    def search(self, query, limit):
+        query = query.lower()
+        queryset = Ingredient.objects.annotate(lower_name=Lower("name"))
+        if len(query) < SUBSTRING_MIN_LENGTH:
+            return queryset.filter(
+                lower_name__startswith=query).order_by("name")[:limit]
+        return (
+            queryset.filter(lower_name__contains=query)
+            .annotate(
+                is_substring=Case(
+                    When(lower_name__startswith=query, then=Value(0)),
+                    default=Value(1),
+                    output_field=IntegerField(),
+                ),
+                similarity=TrigramSimilarity("name", query),
+            )
+            .order_by("is_substring", "-similarity", "name")[:limit]
+        )
+
+
+class SortedArrayIngredientSearch:
+    """Поиск по отсортированному массиву в памяти процесса (для SQLite).
+
+    Массив перестраивается, когда сигналы меняют версию ингредиентов.
+    """
+
+    def __init__(self):
+        self.version = None
+        self.keys = []
+        self.rows = []
+
+    def load(self):
+        version = get_cache_version(INGREDIENTS_VERSION)
+        if version == self.version:
+            return self.keys, self.rows
+        rows = sorted(
+            (name.lower(), name, pk, measurement_unit)
+            for pk, name, measurement_unit in Ingredient.objects.values_list(
+                "id", "name", "measurement_unit")
+        )
+        self.keys, self.rows = [row[0] for row in rows], rows
+        self.version = version
+        return self.keys, self.rows
+
+    def search(self, query, limit):
+        query = query.lower()
+        keys, rows = self.load()
+        found = []
+        position = bisect_left(keys, query)
+        while (
+            position < len(keys)
+            and keys[position].startswith(query)
+            and len(found) < limit
+        ):
+            found.append(rows[position])
+            position += 1
+        if len(found) < limit and len(query) >= SUBSTRING_MIN_LENGTH:
+            substring = sorted(
+                (key.find(query), row)
+                for key, row in zip(keys, rows)
+                if key.find(query) > 0
+            )
+            found.extend(row for _, row in substring[:limit - len(found)])
+        return [
+            Ingredient(id=pk, name=name, measurement_unit=measurement_unit)
+            for _, name, pk, measurement_unit in found
+        ]
+
+
+ENGINES = {
+    "postgres": PostgresIngredientSearch(),
+    "memory": SortedArrayIngredientSearch(),
+}
+
+
+def get_ingredient_search():
+    backend = settings.INGREDIENT_SEARCH_BACKEND
+    if backend == "auto":
+        backend = "postgres" if connection.vendor == "postgresql" else "memory"
+    return ENGINES[backend]
+
+
+def search_ingredients(query, limit=None):
+    limit = min(limit or settings.INGREDIENT_SEARCH_LIMIT,
+                settings.INGREDIENT_SEARCH_LIMIT)
+    return get_ingredient_search().search(query, limit)
@@ -0,0 +1,231 @@
+import threading
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import (m2m_changed, post_delete, post_init,
+                                      post_save, pre_delete)
+from django.dispatch import receiver
+
+from users.models import Follow
+from .models import (FavoriteRecipes, Ingredient, Recipe, RecipeIngredient,
+                     RecipeTag, ShoppingCart, Tag)
+from .images import get_pipeline
+from .search import INGREDIENTS_VERSION
+from .storage import change_references
+from .utils import (bump_cache_version, change_counter,
+                    invalidate_carts_with_recipe, invalidate_recipe_flags,
+                    invalidate_shopping_cart)
+
+User = get_user_model()
+
+# Строки (модель, pk), которые сейчас удаляются в этом потоке,
+# и рецепты, чьи теги сейчас меняет менеджер recipe.tags
+_local = threading.local()
+
+# Счётчики на строках: модель -> (модель со счётчиком, ключ, поле)
+COUNTERS = {
+    FavoriteRecipes: (Recipe, "recipe_id", "favorites_count"),
+    ShoppingCart: (Recipe, "recipe_id", "in_carts_count"),
+    Follow: (User, "author_id", "followers_count"),
+}
+
+
+def deleting():
+    if not hasattr(_local, "rows"):
+        _local.rows = set()
+    return _local.rows
+
+
+def tags_changing():
+    if not hasattr(_local, "tagged"):
+        _local.tagged = set()
+    return _local.tagged
+
+
+@receiver(pre_delete, sender=Recipe)
+@receiver(pre_delete, sender=User)
+@receiver(pre_delete, sender=Tag)
+def row_deleting(sender, instance, **kwargs):
+    # Каскад удаляет зависимые строки раньше самой строки:
+    # счётчики и кеши удаляемой строки им обновлять незачем
+    deleting().add((sender, instance.pk))
+
+
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=User)
+@receiver(post_delete, sender=Tag)
+def row_deleted(sender, instance, **kwargs):
+    deleting().discard((sender, instance.pk))
+
+
+@receiver(post_init, sender=FavoriteRecipes)
+@receiver(post_init, sender=ShoppingCart)
+@receiver(post_init, sender=Follow)
+def remember_counted(sender, instance, **kwargs):
+    _, key, _ = COUNTERS[sender]
+    if key not in instance.get_deferred_fields():
+        instance.counted_id = getattr(instance, key)
+
+
+@receiver(post_save, sender=FavoriteRecipes)
+@receiver(post_save, sender=ShoppingCart)
+@receiver(post_save, sender=Follow)
+def counted_saved(sender, instance, created, **kwargs):
+    """Сохранение через ORM, например из админки.
+
+    API вставляет и удаляет эти строки без сигналов и меняет
+    счётчики сам.
+    """
+    model, key, counter = COUNTERS[sender]
+    counted_id = getattr(instance, key)
+    stored_id = None if created else getattr(instance, "counted_id", None)
+    if counted_id == stored_id:
+        return
+    change_counter(model.objects.filter(pk=counted_id), counter, 1)
+    if stored_id is not None:
+        change_counter(model.objects.filter(pk=stored_id), counter, -1)
+    instance.counted_id = counted_id
+
+
+@receiver(post_delete, sender=FavoriteRecipes)
+@receiver(post_delete, sender=ShoppingCart)
+@receiver(post_delete, sender=Follow)
+def counted_deleted(sender, instance, **kwargs):
+    model, key, counter = COUNTERS[sender]
+    counted_id = getattr(instance, key)
+    if (model, counted_id) not in deleting():
+        change_counter(model.objects.filter(pk=counted_id), counter, -1)
+
+
+@receiver([post_save, post_delete], sender=ShoppingCart)
+def shopping_cart_changed(sender, instance, **kwargs):
+    invalidate_shopping_cart(instance.user_id)
+
+
+@receiver([post_save, post_delete], sender=ShoppingCart)
+@receiver([post_save, post_delete], sender=FavoriteRecipes)
+@receiver([post_save, post_delete], sender=Follow)
+def recipe_flags_changed(sender, instance, **kwargs):
+    invalidate_recipe_flags(instance.user_id)
+
+
+@receiver(post_save, sender=User)
+def user_changed(sender, instance, created, update_fields, **kwargs):
+    # Поля автора входят в ответы с рецептами: их кеш и ETag
+    # завязаны на updated_at. Вход в систему профиль не меняет.
+    if created or update_fields == frozenset({"last_login"}):
+        return
+    Recipe.objects.filter(author=instance).touch()
+
+
+@receiver(post_init, sender=Recipe)
+def remember_image(sender, instance, **kwargs):
+    if "image" not in instance.get_deferred_fields():
+        instance.stored_image = instance.image.name
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_changed(sender, instance, created, **kwargs):
+    if created:
+        change_counter(
+            User.objects.filter(pk=instance.author_id), "recipes_count", 1)
+    stored_image = None if created else getattr(instance, "stored_image", None)
+    if instance.image.name != stored_image:
+        change_references(instance.image.name, 1)
+        change_references(stored_image, -1)
+        instance.stored_image = instance.image.name
+    invalidate_carts_with_recipe(instance.id)
+    # Состав пишется после рецепта в той же транзакции
+    transaction.on_commit(
+        lambda: Recipe.objects.filter(pk=instance.pk).update_search_vector())
+    if instance.image and (
+        instance.renditions.get("source") != instance.image.name
+    ):
+        transaction.on_commit(
+            lambda: get_pipeline().submit(instance.pk, instance.image.name))
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_deleted(sender, instance, **kwargs):
+    if (User, instance.author_id) not in deleting():
+        change_counter(
+            User.objects.filter(pk=instance.author_id), "recipes_count", -1)
+    change_references(getattr(instance, "stored_image", None), -1)
+
+
+@receiver([post_save, post_delete], sender=RecipeIngredient)
+def recipe_ingredient_changed(sender, instance, **kwargs):
+    """Правка одной строки состава, например из админки.
+
+    Сериализатор меняет состав запросами без сигналов и обновляет
+    зависимое сам, один раз на рецепт.
+    """
+    if (Recipe, instance.recipe_id) in deleting():
+        return
+    invalidate_carts_with_recipe(instance.recipe_id)
+    recipes = Recipe.objects.filter(pk=instance.recipe_id)
+    recipes.update_search_vector()
+    recipes.touch()
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def recipe_tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse and action in ("pre_remove", "pre_clear"):
+        # Строки удаляются с сигналами: рецепт обновим один раз ниже
+        tags_changing().add(instance.pk)
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if reverse:
+        # Удалённые строки обновили свои рецепты сами
+        if action == "post_add":
+            Recipe.objects.filter(pk__in=pk_set).touch()
+    else:
+        tags_changing().discard(instance.pk)
+        Recipe.objects.filter(pk=instance.pk).touch()
+
+
+@receiver(post_init, sender=RecipeTag)
+def remember_tagged(sender, instance, **kwargs):
+    if "recipe_id" not in instance.get_deferred_fields():
+        instance.tagged_id = instance.recipe_id
+
+
+@receiver(post_save, sender=RecipeTag)
+def recipe_tag_saved(sender, instance, created, **kwargs):
+    """Правка строки тегов мимо recipe.tags, например из админки"""
+    tagged_id = None if created else getattr(instance, "tagged_id", None)
+    Recipe.objects.filter(
+        pk__in={instance.recipe_id, tagged_id} - {None}).touch()
+    instance.tagged_id = instance.recipe_id
+
+
+@receiver(post_delete, sender=RecipeTag)
+def recipe_tag_deleted(sender, instance, **kwargs):
+    if (
+        (Recipe, instance.recipe_id) in deleting()
+        or (Tag, instance.tag_id) in deleting()
+        or instance.recipe_id in tags_changing()
+    ):
+        return
+    Recipe.objects.filter(pk=instance.recipe_id).touch()
+
+
+@receiver([post_save, post_delete], sender=Ingredient)
+def ingredient_changed(sender, instance, **kwargs):
+    bump_cache_version(INGREDIENTS_VERSION)
+    if kwargs.get("created"):
+        return
+    Recipe.objects.filter(
+        recipe_with_ingredients__ingredient=instance
+    ).update_search_vector()
+
+
+@receiver([post_save, post_delete], sender=Tag)
+def tag_changed(sender, instance, **kwargs):
+    bump_cache_version(Tag._meta.label)
+
+
+@receiver(pre_delete, sender=Tag)
+def tag_deleting(sender, instance, **kwargs):
+    # Каскад удалит строки тегов по одной: рецепты обновляем сразу все
+    Recipe.objects.filter(tags=instance).touch()
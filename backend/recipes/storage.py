@@ -0,0 +1,50 @@
+import hashlib
+import posixpath
+
+from django.core.files.storage import FileSystemStorage
+from django.db.models import F
+from django.utils import timezone
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """Имя файла - SHA-256 содержимого.
+
+    Одинаковые картинки хранятся одним файлом: если такой файл уже
+    есть, повторная запись не выполняется.
+    """
+
+    def save(self, name, content, max_length=None):
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        directory, filename = posixpath.split(name)
+        extension = posixpath.splitext(filename)[1].lower()
+        name = posixpath.join(directory, digest.hexdigest() + extension)
+        if self.exists(name):
+            return name
+        return super().save(name, content, max_length)
+
+    def save_derived(self, name, content, max_length=None):
+        """Файл, имя которого уже выведено из хеша исходника, например
+        копия картинки: сохраняется под этим именем"""
+        if self.exists(name):
+            return name
+        return super().save(name, content, max_length)
+
+
+image_storage = ContentAddressedStorage()
+
+
+def get_image_storage():
+    return image_storage
+
+
+def change_references(name, delta):
+    """Меняет счётчик ссылок на файл картинки"""
+    from .models import MediaFile
+
+    if not name:
+        return
+    MediaFile.objects.get_or_create(name=name)
+    MediaFile.objects.filter(name=name).update(
+        references=F("references") + delta, updated_at=timezone.now())
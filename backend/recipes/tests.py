@@ -0,0 +1,321 @@
+import shutil
+import tempfile
+from io import BytesIO, StringIO
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+
+from users.models import Follow
+from .images import RENDITIONS, make_renditions, rendition_urls
+from .models import (FavoriteRecipes, Ingredient, Recipe, RecipeIngredient,
+                     RecipeTag, ShoppingCart, Tag)
+from .storage import ContentAddressedStorage, image_storage
+from .utils import iter_shopping_cart, percentile
+
+User = get_user_model()
+
+
+class RecipeIngredientSignalsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create(
+            username="author", email="author@example.com")
+        cls.ingredients = Ingredient.objects.bulk_create(
+            Ingredient(name=f"ингредиент {i}", measurement_unit="г")
+            for i in range(60)
+        )
+
+    def create_recipe(self, ingredients):
+        recipe = Recipe.objects.create(
+            author=self.author, name="рецепт", text="Смешать.",
+            cooking_time=10, image="media/recipe.jpg")
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe=recipe, ingredient=ingredient, amount=1)
+            for ingredient in self.ingredients[:ingredients]
+        )
+        return recipe
+
+    def delete_queries(self, ingredients):
+        recipe = self.create_recipe(ingredients)
+        with CaptureQueriesContext(connection) as context:
+            recipe.delete()
+        return len(context.captured_queries)
+
+    def test_cascade_delete_does_not_touch_recipe_per_row(self):
+        self.assertEqual(self.delete_queries(1), self.delete_queries(60))
+
+    def test_single_row_change_updates_recipe(self):
+        recipe = self.create_recipe(1)
+        updated_at = Recipe.objects.get(pk=recipe.pk).updated_at
+        RecipeIngredient.objects.create(
+            recipe=recipe, ingredient=self.ingredients[1], amount=5)
+        self.assertGreater(
+            Recipe.objects.get(pk=recipe.pk).updated_at, updated_at)
+
+
+class CountersSignalsTest(TestCase):
+    """Счётчики при изменениях через ORM: админка и каскады"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create(
+            username="author", email="author@example.com")
+        cls.reader = User.objects.create(
+            username="reader", email="reader@example.com")
+        cls.recipe = Recipe.objects.create(
+            author=cls.author, name="рецепт", text="Смешать.",
+            cooking_time=10, image="media/recipe.jpg")
+
+    def counters(self):
+        recipe = Recipe.objects.get(pk=self.recipe.pk)
+        author = User.objects.get(pk=self.author.pk)
+        return (
+            recipe.favorites_count, recipe.in_carts_count,
+            author.followers_count, author.recipes_count,
+        )
+
+    def test_create_and_delete(self):
+        favorite = FavoriteRecipes.objects.create(
+            user=self.reader, recipe=self.recipe)
+        cart = ShoppingCart.objects.create(
+            user=self.reader, recipe=self.recipe)
+        follow = Follow.objects.create(user=self.reader, author=self.author)
+        self.assertEqual(self.counters(), (1, 1, 1, 1))
+        favorite.delete()
+        cart.delete()
+        follow.delete()
+        self.assertEqual(self.counters(), (0, 0, 0, 1))
+
+    def test_change_target(self):
+        other = Recipe.objects.create(
+            author=self.author, name="другой", text="Смешать.",
+            cooking_time=10, image="media/recipe.jpg")
+        favorite = FavoriteRecipes.objects.create(
+            user=self.reader, recipe=self.recipe)
+        favorite = FavoriteRecipes.objects.get(pk=favorite.pk)
+        favorite.recipe = other
+        favorite.save()
+        self.assertEqual(self.counters()[0], 0)
+        self.assertEqual(
+            Recipe.objects.get(pk=other.pk).favorites_count, 1)
+
+    def test_user_cascade(self):
+        FavoriteRecipes.objects.create(user=self.reader, recipe=self.recipe)
+        ShoppingCart.objects.create(user=self.reader, recipe=self.recipe)
+        Follow.objects.create(user=self.reader, author=self.author)
+        self.reader.delete()
+        self.assertEqual(self.counters(), (0, 0, 0, 1))
+
+
+class ShoppingCartCacheTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(
+            username="reader", email="reader@example.com")
+        cls.ingredient = Ingredient.objects.create(
+            name="мука", measurement_unit="г")
+        recipe = Recipe.objects.create(
+            author=cls.user, name="рецепт", text="Смешать.",
+            cooking_time=10, image="media/recipe.jpg")
+        RecipeIngredient.objects.create(
+            recipe=recipe, ingredient=cls.ingredient, amount=100)
+        ShoppingCart.objects.create(user=cls.user, recipe=recipe)
+
+    def test_ingredient_change_resets_cached_list(self):
+        self.assertEqual(
+            list(iter_shopping_cart(self.user)), [("мука", "г", 100)])
+        self.ingredient.name = "мука пшеничная"
+        self.ingredient.measurement_unit = "кг"
+        self.ingredient.save()
+        self.assertEqual(
+            list(iter_shopping_cart(self.user)),
+            [("мука пшеничная", "кг", 100)])
+
+
+class PercentileTest(TestCase):
+    def test_nearest_rank(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 95), 95)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile(values, 100), 100)
+        self.assertEqual(percentile(values, 0), 1)
+        self.assertEqual(percentile([1, 2, 3, 4], 50), 2)
+        self.assertEqual(percentile([], 95), 0.0)
+
+
+class RenditionsTest(TestCase):
+    def setUp(self):
+        media_root, images_root = tempfile.mkdtemp(), tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        self.addCleanup(shutil.rmtree, images_root)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        # Картинки рецептов не в MEDIA_ROOT: копии должны лечь к ним
+        self.storage = ContentAddressedStorage(
+            location=images_root, base_url="/images/")
+        field = mock.patch.object(
+            Recipe._meta.get_field("image"), "storage", self.storage)
+        field.start()
+        self.addCleanup(field.stop)
+
+    def test_renditions_are_stored_next_to_image(self):
+        buffer = BytesIO()
+        Image.new("RGB", (1200, 900), (226, 108, 45)).save(buffer, "JPEG")
+        name = self.storage.save(
+            "media/recipe.jpg", ContentFile(buffer.getvalue()))
+        author = User.objects.create(
+            username="author", email="author@example.com")
+        recipe = Recipe.objects.create(
+            author=author, name="рецепт", text="Смешать.",
+            cooking_time=10, image=name)
+        make_renditions(recipe.pk, name)
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.renditions["source"], name)
+        for size_name in RENDITIONS:
+            self.assertTrue(self.storage.exists(
+                recipe.renditions[size_name]))
+        self.assertEqual(rendition_urls(recipe), {
+            size_name: self.storage.url(recipe.renditions[size_name])
+            for size_name in RENDITIONS
+        })
+
+
+class AdminChangelistTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create(
+            username="admin", email="admin@example.com",
+            is_staff=True, is_superuser=True)
+        cls.author = User.objects.create(
+            username="author", email="author@example.com")
+        recipe = Recipe.objects.create(
+            author=cls.author, name="рецепт", text="Смешать.",
+            cooking_time=10, image="media/recipe.jpg")
+        tag = Tag.objects.create(name="тег", slug="tag", color="#FF0000")
+        RecipeTag.objects.create(recipe=recipe, tag=tag)
+        FavoriteRecipes.objects.create(user=cls.author, recipe=recipe)
+        Follow.objects.create(user=cls.admin, author=cls.author)
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def test_foreign_keys_stay_editable(self):
+        for url, fields in (
+            ("/admin/recipes/recipetag/", ("recipe", "tag")),
+            ("/admin/recipes/favoriterecipes/", ("recipe", "user")),
+            ("/admin/users/follow/", ("user", "author")),
+        ):
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                for field in fields:
+                    self.assertContains(response, f'name="form-0-{field}"')
+                    self.assertContains(response, "admin-autocomplete")
+
+    def test_author_filter_is_an_input(self):
+        response = self.client.get(
+            "/admin/recipes/recipe/", {"author": "author"})
+        self.assertContains(response, 'name="author" value="author"')
+        self.assertEqual(len(response.context["cl"].result_list), 1)
+        response = self.client.get(
+            "/admin/recipes/recipe/", {"author": "nobody"})
+        self.assertEqual(len(response.context["cl"].result_list), 0)
+
+
+class RecipeTagSignalsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create(
+            username="author", email="author@example.com")
+        cls.tags = Tag.objects.bulk_create(
+            Tag(name=f"тег {i}", slug=f"tag-{i}", color="#FF0000")
+            for i in range(4))
+        cls.recipes = [
+            Recipe.objects.create(
+                author=author, name=f"рецепт {i}", text="Смешать.",
+                cooking_time=10, image="media/recipe.jpg")
+            for i in range(3)
+        ]
+        for recipe in cls.recipes:
+            recipe.tags.set(cls.tags)
+
+    def updated_at(self, recipe):
+        return Recipe.objects.get(pk=recipe.pk).updated_at
+
+    def recipe_updates(self, action):
+        with CaptureQueriesContext(connection) as context:
+            action()
+        return [
+            query["sql"] for query in context.captured_queries
+            if query["sql"].startswith('UPDATE "recipes_recipe"')
+        ]
+
+    def test_direct_row_changes_touch_recipe(self):
+        recipe = self.recipes[0]
+        updated_at = self.updated_at(recipe)
+        RecipeTag.objects.filter(recipe=recipe, tag=self.tags[0]).delete()
+        self.assertGreater(self.updated_at(recipe), updated_at)
+        updated_at = self.updated_at(recipe)
+        RecipeTag.objects.create(recipe=recipe, tag=self.tags[0])
+        self.assertGreater(self.updated_at(recipe), updated_at)
+
+    def test_moved_row_touches_both_recipes(self):
+        source, target = self.recipes[0], self.recipes[1]
+        row = RecipeTag.objects.get(recipe=target, tag=self.tags[0])
+        row.delete()
+        row = RecipeTag.objects.get(recipe=source, tag=self.tags[0])
+        before = self.updated_at(source), self.updated_at(target)
+        row.recipe = target
+        row.save()
+        self.assertGreater(self.updated_at(source), before[0])
+        self.assertGreater(self.updated_at(target), before[1])
+
+    def test_manager_changes_touch_recipe_once(self):
+        recipe = self.recipes[0]
+        self.assertEqual(len(self.recipe_updates(
+            lambda: recipe.tags.set(self.tags[:1]))), 1)
+
+    def test_tag_delete_touches_recipes_once(self):
+        before = [self.updated_at(recipe) for recipe in self.recipes]
+        self.assertEqual(
+            len(self.recipe_updates(self.tags[0].delete)), 1)
+        for recipe, updated_at in zip(self.recipes, before):
+            self.assertGreater(self.updated_at(recipe), updated_at)
+
+
+class GenerateDataTest(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f"ингредиент {i}", measurement_unit="г")
+            for i in range(20)
+        )
+
+    def generate(self, *args):
+        call_command(
+            "generatedata", "--users", "10", "--recipes-per-author", "2",
+            *args, stdout=StringIO())
+
+    def test_recipes_point_at_stored_image(self):
+        self.generate()
+        images = set(Recipe.objects.values_list("image", flat=True))
+        self.assertEqual(len(images), 1)
+        name = images.pop()
+        self.assertTrue(image_storage.exists(name))
+        modified = image_storage.get_modified_time(name)
+        self.generate("--clear")
+        self.assertEqual(
+            set(Recipe.objects.values_list("image", flat=True)), {name})
+        self.assertEqual(image_storage.get_modified_time(name), modified)
@@ -1,8 +1,9 @@
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
-from api.views import (FavoriteView, GetShoppingList, IngredientViewSet,
-                       RecipeViewSet, ShoppingCartView, TagViewSet)
+from api.views import (FavoriteBulkView, FavoriteView, GetShoppingList,
+                       IngredientViewSet, ProfilingView, RecipeViewSet,
+                       ShoppingCartBulkView, ShoppingCartView, TagViewSet)
 
 router = DefaultRouter()
 
@@ -15,6 +16,9 @@ router.register("tags", TagViewSet, basename="tags")
 urlpatterns = [
     path("recipes/<int:recipe_id>/favorite/", FavoriteView.as_view()),
     path("recipes/<int:recipe_id>/shopping_cart/", ShoppingCartView.as_view()),
+    path("recipes/favorite/", FavoriteBulkView.as_view()),
+    path("recipes/shopping_cart/", ShoppingCartBulkView.as_view()),
     path("recipes/download_shopping_cart/", GetShoppingList.as_view()),
+    path("profiling/", ProfilingView.as_view()),
     path("", include(router.urls)),
 ]
@@ -1,19 +1,215 @@
-from django.db.models import Sum
+import csv
+import json
+import math
+from io import BytesIO
 
-from .models import RecipeIngredient
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
 
+from .models import Ingredient, RecipeIngredient, ShoppingCart
 
-def make_shopping_cart(request):
-    ingredients = (
-        RecipeIngredient.objects.filter(
-            recipe__carts_recipe__user=request.user)
+SHOPPING_CART_CACHE_KEY = "shopping_cart:{user_id}:{version}:{ingver}"
+SHOPPING_CART_CHUNK_SIZE = 500
+
+
+def get_cache_version(name):
+    return cache.get_or_set(f"version:{name}", 1, timeout=None)
+
+
+def bump_cache_version(name):
+    """Сбрасывает всё, что закешировано под этим именем"""
+    key = f"version:{name}"
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 2, timeout=None)
+
+
+def change_counter(queryset, field, delta):
+    """Сдвигает счётчик одним UPDATE, не опуская его ниже нуля"""
+    if not delta:
+        return
+    if delta < 0:
+        queryset = queryset.filter(**{f"{field}__gte": -delta})
+    queryset.update(**{field: F(field) + delta})
+
+
+def insert_ignore(rows, objs):
+    """bulk_create(ignore_conflicts=True), возвращает число новых строк.
+
+    bulk_create при ignore_conflicts не сообщает, что было вставлено,
+    поэтому rows - строки, которые может задеть вставка, - считаются
+    до и после. Вызывать внутри транзакции. Сигналы не отправляются.
+    """
+    objs = list(objs)
+    if not objs:
+        return 0
+    before = rows.count()
+    rows.model.objects.bulk_create(objs, ignore_conflicts=True)
+    return rows.count() - before
+
+
+def delete_rows(queryset):
+    """Один DELETE без выборки строк, сигналов и каскадов.
+
+    QuerySet.delete() при подписанных на модель сигналах сначала
+    выбирает строки и шлёт post_delete на каждую. Здесь вызывается
+    приватный QuerySet._raw_delete, поэтому годится он только для
+    моделей без зависимых строк, а то, что сделали бы сигналы,
+    вызывающий код делает сам: это отмечено у каждого вызова.
+    """
+    return queryset._raw_delete(queryset.db)
+
+
+def actual_count(model, field):
+    """Число строк model, ссылающихся на строку по внешнему ключу field"""
+    return Coalesce(
+        Subquery(
+            model.objects.filter(**{field: OuterRef("pk")})
+            .order_by()
+            .values(field)
+            .annotate(total=Count("id"))
+            .values("total")
+        ),
+        0,
+    )
+
+
+def percentile(values, percent):
+    """Перцентиль по ближайшему рангу: наименьшее значение, которого
+    не превышают percent процентов выборки"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = math.ceil(percent / 100 * len(ordered))
+    return ordered[min(len(ordered), max(rank, 1)) - 1]
+
+
+def invalidate_shopping_cart(*user_ids):
+    for user_id in set(user_ids):
+        bump_cache_version(f"shopping_cart:{user_id}")
+
+
+def get_flags_version(user):
+    """Версия избранного, списка покупок и подписок пользователя"""
+    return get_cache_version(f"recipe_flags:{user.id}")
+
+
+def invalidate_recipe_flags(*user_ids):
+    for user_id in set(user_ids):
+        bump_cache_version(f"recipe_flags:{user_id}")
+
+
+def invalidate_carts_with_recipe(recipe_id):
+    invalidate_shopping_cart(
+        *ShoppingCart.objects.filter(recipe_id=recipe_id).values_list(
+            "user_id", flat=True)
+    )
+
+
+def iter_shopping_cart(user):
+    """Сводный список покупок пользователя.
+
+    Строки читаются курсором на стороне сервера и по мере чтения
+    складываются в кеш; при следующих скачиваниях агрегация
+    не повторяется, пока кеш не сброшен сигналами списка покупок,
+    рецептов или ингредиентов.
+    """
+    key = SHOPPING_CART_CACHE_KEY.format(
+        user_id=user.id,
+        version=get_cache_version(f"shopping_cart:{user.id}"),
+        # Название и единица берутся из ингредиента
+        ingver=get_cache_version(Ingredient._meta.label),
+    )
+    ingredients = cache.get(key)
+    if ingredients is not None:
+        yield from ingredients
+        return
+    ingredients = []
+    queryset = (
+        RecipeIngredient.objects.filter(recipe__carts_recipe__user=user)
         .values_list("ingredient__name", "ingredient__measurement_unit")
         .annotate(amount=Sum("amount"))
+        .order_by("ingredient__name", "ingredient__measurement_unit")
     )
-    shopping_cart = "\n".join(
-        [
-            f"{ingredient_name} ({measurement_unit}) - {amount}"
-            for ingredient_name, measurement_unit, amount in ingredients
-        ]
-    )
-    return shopping_cart
+    for ingredient in queryset.iterator(chunk_size=SHOPPING_CART_CHUNK_SIZE):
+        ingredients.append(ingredient)
+        yield ingredient
+    cache.set(key, ingredients)
+
+
+class Echo:
+    def write(self, value):
+        return value
+
+
+def render_txt(ingredients):
+    for ingredient_name, measurement_unit, amount in ingredients:
+        yield f"{ingredient_name} ({measurement_unit}) - {amount}\n"
+
+
+def render_csv(ingredients):
+    writer = csv.writer(Echo())
+    yield writer.writerow(("name", "measurement_unit", "amount"))
+    for ingredient in ingredients:
+        yield writer.writerow(ingredient)
+
+
+def render_json(ingredients):
+    separator = "["
+    for ingredient_name, measurement_unit, amount in ingredients:
+        yield separator + json.dumps(
+            {
+                "name": ingredient_name,
+                "measurement_unit": measurement_unit,
+                "amount": amount,
+            },
+            ensure_ascii=False,
+        )
+        separator = ","
+    yield "[]" if separator == "[" else "]"
+
+
+def render_pdf(ingredients):
+    """PDF собирается локально через reportlab со шрифтом из настроек"""
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+    from reportlab.pdfgen import canvas
+
+    font_name = "ShoppingCartFont"
+    if font_name not in pdfmetrics.getRegisteredFontNames():
+        pdfmetrics.registerFont(
+            TTFont(font_name, settings.SHOPPING_CART_PDF_FONT))
+    buffer = BytesIO()
+    page = canvas.Canvas(buffer, pagesize=A4)
+    width, height = A4
+    margin = 50
+    line_height = 18
+    y = height - margin
+    page.setFont(font_name, 12)
+    for line in render_txt(ingredients):
+        if y < margin:
+            page.showPage()
+            page.setFont(font_name, 12)
+            y = height - margin
+        page.drawString(margin, y, line.rstrip("\n"))
+        y -= line_height
+    page.save()
+    buffer.seek(0)
+    yield from iter(lambda: buffer.read(8192), b"")
+
+
+SHOPPING_CART_FORMATS = {
+    "txt": ("text/plain; charset=utf-8", render_txt),
+    "csv": ("text/csv; charset=utf-8", render_csv),
+    "json": ("application/json", render_json),
+    "pdf": ("application/pdf", render_pdf),
+}
+
+
+def make_shopping_cart(user, file_format="txt"):
+    content_type, render = SHOPPING_CART_FORMATS[file_format]
+    return content_type, render(iter_shopping_cart(user))
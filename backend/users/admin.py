@@ -9,7 +9,9 @@ class UserAdmin(admin.ModelAdmin):
         'username',
         'email',
         'first_name',
-        'last_name'
+        'last_name',
+        'recipes_count',
+        'followers_count'
     )
     list_editable = (
         'username',
@@ -28,6 +30,9 @@ class FollowAdmin(admin.ModelAdmin):
         'author'
     )
     list_editable = ('user', 'author')
+    list_select_related = ('user', 'author')
+    autocomplete_fields = ('user', 'author')
+    show_full_result_count = False
 
 
 admin.site.register(User, UserAdmin)
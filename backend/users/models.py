@@ -8,6 +8,10 @@ class User(AbstractUser):
     email = models.EmailField(max_length=50, unique=True)
     first_name = models.CharField(max_length=50)
     last_name = models.CharField(max_length=50)
+    recipes_count = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name="Рецептов")
+    followers_count = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name="Подписчиков")
 
     class Meta:
         verbose_name = "Пользователь"